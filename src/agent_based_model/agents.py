@@ -3,9 +3,9 @@ from shapely.geometry import Point
 
 
 class BikerAgent(mg.GeoAgent):
-    """An agent with fixed journey."""
+    """An agent with fixed journey. The model's HeadlessEngine moves it, the agent mirrors where it is for display."""
 
-    def __init__(self, unique_id, model, geometry, crs, origin, destination, route, G, trip_count):
+    def __init__(self, unique_id, model, geometry, crs, origin, destination, route, G, trip_count, biker_slot=None):
         '''
         Create a new traveler agent.
         :param unique_id: Unique id for agent
@@ -14,6 +14,7 @@ class BikerAgent(mg.GeoAgent):
         :param origin: Origin of their journey
         :param destination: Destination of their journey
         :param route: Shortest path route between their origin and destination
+        :param biker_slot: Index of the biker in the model engine's arrays
         '''
         super().__init__(unique_id, model, geometry, crs)
 
@@ -21,26 +22,26 @@ class BikerAgent(mg.GeoAgent):
         self.origin = origin
         self.destination = destination
         self.route = route
-        self.cur_time_step = 0
-        self.heat_accumulation = 0
+        self.biker_slot = biker_slot
         self.color = None
         self.G = G
         self.trip_count = trip_count
         #self.isElectric = isElectric # TODO: incorporate is electric to heat acculumation function
 
-    def get_heat_accumulation(self, edge_data, next_node_dict):
+    @property
+    def heat_accumulation(self):
+        # biker heat lives in the engine's per biker array, see BikerModel.biker_heat
+        return self.model.biker_heat[self.biker_slot]
 
-        t2_measurement = float(next_node_dict['t2'])
-        if 'travel_time' in edge_data and edge_data['travel_time'] and edge_data['travel_time'] > 0:
-            time = edge_data['travel_time']
-        else:
-            max_speed = 15  # average cyclist speed is about 10mph, e-bike about 20
-            if 'speed_kph' in edge_data and edge_data['speed_kph'] and edge_data['speed_kph'] > 0:
-                max_speed = edge_data['speed_kph'] / 3.6
-            length = edge_data['length']  # returns length in meters
-            time = length / max_speed
+    @property
+    def cur_time_step(self):
+        # hops of the route taken so far
+        return int(self.model.engine.cursor[self.biker_slot])
 
-        return time * t2_measurement
+    @property
+    def clock(self):
+        # seconds since the start of the simulation, see HeadlessEngine.clock
+        return float(self.model.engine.clock[self.biker_slot])
 
     def move_point(self, x, y):
         """
@@ -50,40 +51,17 @@ class BikerAgent(mg.GeoAgent):
         """
         return Point(x, y)
 
-    def update_edge(self, edge_id):
-        for agent in self.model.schedule.agents:
-            if isinstance(agent, RoadAgent) and edge_id == agent.edge_id:
-                agent.heat_accumulation += 1
-
     def step(self):
-        # Accumulate heat index based on their route
-        if self.route and self.cur_time_step + 1 < len(self.route):
-            cur_node = self.route[self.cur_time_step]
-            next_node = self.route[self.cur_time_step + 1]
-            next_node_dict = self.G.nodes[next_node]
-            edge_data = self.G.get_edge_data(cur_node, next_node)
-            if len(edge_data) < 1:
-                print("Error: no edge between nodes {} and {} for agent {}".format(str(cur_node), str(next_node), str(self.unique_id)))
-            else:
-                self.heat_accumulation += self.get_heat_accumulation(edge_data[0], next_node_dict)
-
-                # modify road map to record edge travelled over
-                osmid = edge_data[0]['osmid']
-                if str(osmid) in self.model.road_map.keys():
-                    self.model.road_map[str(osmid)] += 1
-                else:
-                    self.model.road_map[str(osmid)] = 1
-
-                # move the biker
-                self.geometry = self.move_point(next_node_dict['x'], next_node_dict['y'])
-        self.cur_time_step += 1
+        # move to where the engine has the biker
+        engine = self.model.engine
+        self.geometry = self.move_point(engine.x[self.biker_slot], engine.y[self.biker_slot])
 
 
 class RoadAgent(mg.GeoAgent):
     """Neighbourhood agent. Changes color according to number of infected inside it."""
 
     def __init__(
-        self, unique_id, model, geometry, crs, heat_contribution, edge_id):
+        self, unique_id, model, geometry, crs, heat_contribution, edge_id, edge_slot=None, osmid=None):
         """
         Create a new Neighbourhood agent.
         :param unique_id:   Unique identifier for the agent
@@ -91,17 +69,28 @@ class RoadAgent(mg.GeoAgent):
         :param geometry:    Shape object for the agent
         :param hotspot_threshold:   Number of infected agents in region
                                     to be considered a hot-spot
+        :param edge_slot:   Slot of the edge in the model's edge index
+        :param osmid:       Osm way id(s) of the edge
         """
         super().__init__(unique_id, model, geometry, crs)
         # self.get_heat_contribution()
         self.edge_id = edge_id
+        self.edge_slot = edge_slot
         self.cur_time_step = 0
         self.heat_contribution = heat_contribution
-        self.heat_accumulation = 0
         self.color = None
-        self.start_node = None
-        self.end_node = None
-        self.osmid = None
+        self.start_node = edge_id[0] if edge_id else None
+        self.end_node = edge_id[1] if edge_id else None
+        self.osmid = osmid
+
+    @property
+    def heat_accumulation(self):
+        # road heat lives in the model's edge-indexed accumulator, see BikerModel.road_heat
+        return self.model.road_heat[self.edge_slot]
+
+    @heat_accumulation.setter
+    def heat_accumulation(self, value):
+        self.model.road_heat[self.edge_slot] = value
 
     def step(self):
         """Advance agent one step."""
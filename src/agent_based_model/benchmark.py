@@ -0,0 +1,203 @@
+import argparse
+import json
+import math
+import os
+import subprocess
+import time
+from datetime import datetime
+import numpy as np
+import networkx as nx
+from shapely.geometry import LineString
+from model import BikerModel
+from profiling import peak_memory_mb
+from routes import RouteStore
+
+# synthetic graphs are placed around lower manhattan so coordinates and distances look like the real heat graph
+ORIGIN_LON = -74.0
+ORIGIN_LAT = 40.7
+METERS_PER_DEGREE_LAT = 110540
+METERS_PER_DEGREE_LON = 111320 * math.cos(math.radians(ORIGIN_LAT))
+CYCLIST_SPEED = 4.2  # meters per second, about 15 kph
+
+
+def add_osm_edge(G, u, v, osmid):
+    """Add an edge in both directions with the attributes osmnx gives the heat graph"""
+    a = G.nodes[u]
+    b = G.nodes[v]
+    length = math.hypot((a['x'] - b['x']) * METERS_PER_DEGREE_LON, (a['y'] - b['y']) * METERS_PER_DEGREE_LAT)
+    for start, end in ((u, v), (v, u)):
+        G.add_edge(start, end, 0, osmid=osmid, length=length, travel_time=length / CYCLIST_SPEED,
+                   geometry=LineString([(G.nodes[start]['x'], G.nodes[start]['y']),
+                                        (G.nodes[end]['x'], G.nodes[end]['y'])]))
+
+
+def heat_values(x, y, rng):
+    """Smooth t2 surface in kelvin, warmer towards the middle of the graph, with a little noise"""
+    cx, cy = x.mean(), y.mean()
+    spread = max(np.ptp(x), np.ptp(y), 1e-9)
+    distance = np.hypot(x - cx, y - cy) / spread
+    return 303 - 4 * distance + rng.normal(0, 0.2, len(x))
+
+
+def grid_graph(rows, cols, spacing=100, seed=0):
+    '''
+    Osmnx style MultiDiGraph of a street grid
+    :param rows: Number of streets running east west
+    :param cols: Number of avenues running north south
+    :param spacing: Meters between intersections
+    '''
+    rng = np.random.default_rng(seed)
+    G = nx.MultiDiGraph(crs="epsg:4326")
+    ids = np.arange(rows * cols).reshape(rows, cols) + 1
+    x = ORIGIN_LON + np.tile(np.arange(cols), rows) * spacing / METERS_PER_DEGREE_LON
+    y = ORIGIN_LAT + np.repeat(np.arange(rows), cols) * spacing / METERS_PER_DEGREE_LAT
+    t2 = heat_values(x, y, rng)
+    G.add_nodes_from((int(n), {'x': float(nx_), 'y': float(ny_), 't2': float(t)})
+                     for n, nx_, ny_, t in zip(ids.ravel(), x, y, t2))
+    osmid = 0
+    for r in range(rows):
+        for c in range(cols):
+            if c + 1 < cols:
+                osmid += 1
+                add_osm_edge(G, int(ids[r, c]), int(ids[r, c + 1]), osmid)
+            if r + 1 < rows:
+                osmid += 1
+                add_osm_edge(G, int(ids[r, c]), int(ids[r + 1, c]), osmid)
+    return G
+
+
+def geometric_graph(n, mean_degree=4, extent=5000, seed=0):
+    '''
+    Osmnx style MultiDiGraph of a random geometric graph, keeping only its largest connected component
+    :param n: Number of nodes
+    :param mean_degree: Average number of neighbours of a node, sets the connection radius
+    :param extent: Side of the square the nodes are scattered over, in meters
+    '''
+    rng = np.random.default_rng(seed)
+    radius = math.sqrt(mean_degree / (math.pi * n))
+    U = nx.random_geometric_graph(n, radius, seed=seed)
+    U = U.subgraph(max(nx.connected_components(U), key=len))
+    nodes = sorted(U.nodes)
+    pos = np.array([U.nodes[n]['pos'] for n in nodes])
+    x = ORIGIN_LON + pos[:, 0] * extent / METERS_PER_DEGREE_LON
+    y = ORIGIN_LAT + pos[:, 1] * extent / METERS_PER_DEGREE_LAT
+    t2 = heat_values(x, y, rng)
+    G = nx.MultiDiGraph(crs="epsg:4326")
+    G.add_nodes_from((n + 1, {'x': float(nx_), 'y': float(ny_), 't2': float(t)}) for n, nx_, ny_, t in zip(nodes, x, y, t2))
+    for osmid, (u, v) in enumerate(U.edges, start=1):
+        add_osm_edge(G, u + 1, v + 1, osmid)
+    return G
+
+
+def synthetic_routes(G, agents, pool=500, seed=0):
+    '''
+    Route store of agents bikers, each riding one of a pool of shortest path routes between random nodes
+    :param agents: Number of bikers
+    :param pool: Number of distinct od pairs to route, routing every agent separately is too slow at 1M agents
+    '''
+    rng = np.random.default_rng(seed)
+    nodes = np.array(list(G.nodes))
+    routes = []
+    while len(routes) < pool:
+        origin, destination = rng.choice(nodes, 2, replace=False).tolist()
+        try:
+            route = nx.shortest_path(G, origin, destination, weight='travel_time')
+        except nx.NetworkXNoPath:
+            continue
+        routes.append((origin, route, int(rng.integers(1, 20))))
+    picks = rng.integers(0, len(routes), agents)
+    return RouteStore.from_routes([routes[i] for i in picks.tolist()])
+
+
+def git_commit():
+    """Commit the benchmark ran on, so results can be compared run over run"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark_model(G, routes, headless, steps, k):
+    '''
+    Time building a model, stepping it and reporting the hottest roads and bikers
+    :param steps: Number of steps to time, or None to run every biker to the end of their route
+    :param k: Number of hottest roads and bikers to report
+    :return: Dict of timings
+    '''
+    start = time.perf_counter()
+    model = BikerModel(None, G, headless=headless, routes=routes)
+    construction = time.perf_counter() - start
+
+    start = time.perf_counter()
+    while not model.isFinished and (steps is None or model.steps < steps):
+        model.advance()
+    stepping = time.perf_counter() - start
+
+    start = time.perf_counter()
+    model.get_results(k)
+    top_k = time.perf_counter() - start
+    return {
+        'construction_seconds': construction,
+        'construction_phases': model.construction_times,
+        'steps': model.steps,
+        'step_seconds': stepping,
+        'steps_per_second': model.steps / stepping if stepping > 0 else 0.0,
+        'finished': bool(model.isFinished),
+        'top_k_seconds': top_k,
+        'peak_memory_mb': peak_memory_mb(),
+    }
+
+
+def build_graph(kind, size, seed):
+    """Grid of size x size intersections or random geometric graph of size nodes"""
+    if kind == 'grid':
+        return grid_graph(size, size, seed=seed)
+    return geometric_graph(size, seed=seed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the biker model on synthetic graphs and routes')
+    parser.add_argument('--graph', choices=['grid', 'geometric'], nargs='+', default=['grid', 'geometric'],
+                        help='Kinds of synthetic graph')
+    parser.add_argument('--graph_size', type=int, default=50,
+                        help='Intersections per side for grids, number of nodes for geometric graphs')
+    parser.add_argument('--agents', type=int, nargs='+', default=[1000, 10000, 100000, 1000000],
+                        help='Numbers of bikers to benchmark')
+    parser.add_argument('--mesa_max_agents', type=int, default=100000,
+                        help='Largest number of bikers to also run with mesa agents, larger runs are headless only')
+    parser.add_argument('--steps', type=int, default=None, help='Steps to time, default runs to completion')
+    parser.add_argument('--k', type=int, default=20, help='Hottest roads and bikers to report')
+    parser.add_argument('--route_pool', type=int, default=500, help='Distinct routes shared by the bikers')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic graphs and routes')
+    parser.add_argument('--output', type=str, default='benchmark_results.jsonl',
+                        help='Json lines file the results are appended to')
+    args = parser.parse_args()
+
+    commit = git_commit()
+    run_at = datetime.now().isoformat(timespec='seconds')
+    for kind in args.graph:
+        start = time.perf_counter()
+        G = build_graph(kind, args.graph_size, args.seed)
+        graph_seconds = time.perf_counter() - start
+        for agents in args.agents:
+            routes = synthetic_routes(G, agents, args.route_pool, args.seed)
+            modes = [True, False] if agents <= args.mesa_max_agents else [True]
+            for headless in modes:
+                result = {
+                    'run_at': run_at,
+                    'commit': commit,
+                    'graph': kind,
+                    'graph_size': args.graph_size,
+                    'nodes': G.number_of_nodes(),
+                    'edges': G.number_of_edges(),
+                    'graph_seconds': graph_seconds,
+                    'agents': agents,
+                    'mode': 'headless' if headless else 'mesa',
+                    'seed': args.seed,
+                }
+                result.update(benchmark_model(G, routes, headless, args.steps, args.k))
+                print("{graph} {agents} {mode}: built in {construction_seconds:.2f}s, {steps} steps at "
+                      "{steps_per_second:.1f}/s, top k in {top_k_seconds:.3f}s".format(**result))
+                with open(args.output, 'a') as f:
+                    f.write(json.dumps(result) + '\n')
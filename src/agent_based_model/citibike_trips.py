@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# columns of the monthly citibike csv files the analyses use, the rest (ride ids, station names, member type) are
+# never read. Station ids are kept as the strings in the files, as categories since a few thousand stations repeat
+# over millions of trips, and coordinates as float32 which is still well under a meter
+TRIP_COLUMNS = {
+    'rideable_type': 'category',
+    'started_at': 'datetime',
+    'ended_at': 'datetime',
+    'start_station_id': 'category',
+    'end_station_id': 'category',
+    'start_lat': np.float32,
+    'start_lng': np.float32,
+    'end_lat': np.float32,
+    'end_lng': np.float32,
+}
+# lon_min, lat_min, lon_max, lat_max of new york city, see universal_visitation_law.py
+NYC_BOUNDS = (-74.2591, 40.4774, -73.7004, 40.9176)
+CHUNK_ROWS = 500000
+
+
+def filter_trips(chunk, start=None, end=None, hours=None, bounds=None):
+    '''
+    Trips starting within a time window and with both ends inside bounds
+    :param chunk: DataFrame of trips with started_at parsed
+    :param start: First day to keep, anything pd.Timestamp accepts
+    :param end: Day to stop at, not included
+    :param hours: (first hour, hour to stop at) of the day to keep, e.g. (11, 14) for 11am to 2pm
+    :param bounds: (lon_min, lat_min, lon_max, lat_max) both the start and end of a trip must be in
+    '''
+    keep = np.ones(len(chunk), dtype=bool)
+    if start is not None:
+        keep &= (chunk['started_at'] >= pd.Timestamp(start)).to_numpy()
+    if end is not None:
+        keep &= (chunk['started_at'] < pd.Timestamp(end)).to_numpy()
+    if hours is not None:
+        hour = chunk['started_at'].dt.hour
+        keep &= ((hour >= hours[0]) & (hour < hours[1])).to_numpy()
+    if bounds is not None:
+        lon_min, lat_min, lon_max, lat_max = bounds
+        # missing coordinates fail the comparisons and are dropped too
+        for lat, lng in (('start_lat', 'start_lng'), ('end_lat', 'end_lng')):
+            keep &= ((chunk[lat] >= lat_min) & (chunk[lat] <= lat_max) & (chunk[lng] >= lon_min) &
+                     (chunk[lng] <= lon_max)).to_numpy()
+    return chunk[keep]
+
+
+def read_trip_file(path, columns=None, start=None, end=None, hours=None, bounds=NYC_BOUNDS, chunk_rows=CHUNK_ROWS):
+    '''
+    Read one citibike csv file, keeping only the needed columns and the trips that pass filter_trips. The file is
+    read in chunks of chunk_rows so a whole month never sits in memory unfiltered.
+    :param columns: Names of TRIP_COLUMNS to read, all of them by default
+    :return: DataFrame of the filtered trips
+    '''
+    columns = list(TRIP_COLUMNS) if columns is None else list(columns)
+    # filters need started_at and the coordinates, even if they are not asked for
+    needed = set(columns)
+    if start is not None or end is not None or hours is not None:
+        needed.add('started_at')
+    if bounds is not None:
+        needed.update(('start_lat', 'start_lng', 'end_lat', 'end_lng'))
+    dtype = {name: (str if kind == 'category' else kind) for name, kind in TRIP_COLUMNS.items()
+             if name in needed and kind != 'datetime'}
+
+    chunks = []
+    for chunk in pd.read_csv(path, usecols=[name for name in TRIP_COLUMNS if name in needed], dtype=dtype,
+                             chunksize=chunk_rows):
+        for name in needed:
+            if TRIP_COLUMNS[name] == 'datetime':
+                chunk[name] = pd.to_datetime(chunk[name], format='ISO8601')
+        chunk = filter_trips(chunk, start, end, hours, bounds)[columns]
+        chunks.append(chunk.astype({name: 'category' for name in columns if TRIP_COLUMNS[name] == 'category'}))
+    return concat_trips(chunks, columns)
+
+
+def concat_trips(frames, columns):
+    """Concatenate trip frames, merging their categories so station ids stay categorical"""
+    frames = [frame for frame in frames if len(frame) > 0]
+    if not frames:
+        return pd.DataFrame({name: pd.Series(dtype='category' if TRIP_COLUMNS[name] == 'category' else
+                                             'datetime64[ns]' if TRIP_COLUMNS[name] == 'datetime' else
+                                             TRIP_COLUMNS[name]) for name in columns})
+    trips = {}
+    for name in columns:
+        if TRIP_COLUMNS[name] == 'category':
+            trips[name] = union_categoricals([frame[name] for frame in frames])
+        else:
+            trips[name] = np.concatenate([frame[name].to_numpy() for frame in frames])
+    return pd.DataFrame(trips)
+
+
+def trip_files(csv_directory):
+    """Every csv file in a directory of monthly citibike data, in name order"""
+    return sorted(os.path.join(csv_directory, name) for name in os.listdir(csv_directory) if name.endswith('.csv'))
+
+
+def cache_key(files, columns, start, end, hours, bounds):
+    """Hash of the files (by name, size and modification time) and the options trips were loaded with"""
+    key = {
+        'files': [(os.path.basename(path), os.path.getsize(path), os.path.getmtime(path)) for path in files],
+        'columns': list(columns), 'start': str(start), 'end': str(end), 'hours': hours, 'bounds': bounds,
+    }
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def _read_trip_file(args):
+    path, kwargs = args
+    return read_trip_file(path, **kwargs)
+
+
+def load_trips(csv_directory, columns=None, start=None, end=None, hours=None, bounds=NYC_BOUNDS, cache_dir=None,
+               processes=None, chunk_rows=CHUNK_ROWS):
+    '''
+    Trips of every citibike csv file in a directory, see read_trip_file. The files are read in parallel and the
+    result is cached as parquet, so loading the same files with the same options again takes seconds. The cache is
+    rebuilt whenever a file is added, removed or changed.
+    :param csv_directory: Directory with the raw citibike csv files
+    :param columns: Names of TRIP_COLUMNS to keep, all of them by default
+    :param start: First day to keep, e.g. '2024-05-01'
+    :param end: Day to stop at, not included
+    :param hours: (first hour, hour to stop at) of the day to keep
+    :param bounds: (lon_min, lat_min, lon_max, lat_max) trips must start and end in, None to keep every trip
+    :param cache_dir: Directory of the parquet cache, defaults to trips_cache in csv_directory. False to not cache
+    :param processes: Number of files read at once, defaults to the number of cpus
+    :return: DataFrame of trips
+    '''
+    columns = list(TRIP_COLUMNS) if columns is None else list(columns)
+    files = trip_files(csv_directory)
+    if cache_dir is None:
+        cache_dir = os.path.join(csv_directory, 'trips_cache')
+    cache_path = None
+    if cache_dir is not False:
+        cache_path = os.path.join(cache_dir, "trips_{}.parquet".format(
+            cache_key(files, columns, start, end, list(hours) if hours else None, list(bounds) if bounds else None)))
+        if os.path.exists(cache_path):
+            return pd.read_parquet(cache_path)
+
+    kwargs = {'columns': columns, 'start': start, 'end': end, 'hours': hours, 'bounds': bounds,
+              'chunk_rows': chunk_rows}
+    processes = processes or os.cpu_count()
+    if processes == 1 or len(files) <= 1:
+        frames = [read_trip_file(path, **kwargs) for path in files]
+    else:
+        with ProcessPoolExecutor(min(processes, len(files))) as pool:
+            frames = list(pool.map(_read_trip_file, [(path, kwargs) for path in files]))
+    trips = concat_trips(frames, columns)
+
+    if cache_path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        # write then rename, so a run that dies midway never leaves a cache that looks complete
+        trips.to_parquet(cache_path + '.partial', index=False)
+        os.replace(cache_path + '.partial', cache_path)
+    return trips
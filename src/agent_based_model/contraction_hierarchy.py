@@ -0,0 +1,305 @@
+import hashlib
+import heapq
+import json
+import os
+import numpy as np
+from routing import RoutingGraph, edge_weights
+
+HIERARCHY_ARRAYS = ('node_ids', 'rank', 'up_offsets', 'up_targets', 'up_weights', 'up_middles', 'down_offsets',
+                    'down_sources', 'down_weights', 'down_middles')
+
+
+def hierarchy_path(graph_path, weight):
+    """Path of the contraction hierarchy for one edge weight saved alongside a graphml file"""
+    return os.path.splitext(graph_path)[0] + "_ch_{}.npz".format(weight)
+
+
+def weight_hash(weights):
+    """Hash of the edge weights a hierarchy was built for, so changed t2 values or travel times rebuild it"""
+    return hashlib.sha1(np.ascontiguousarray(weights, dtype=np.float64).tobytes()).hexdigest()[:16]
+
+
+def csr(rows, n):
+    '''
+    Per node lists of (node, weight, middle) edges as offsets and flat arrays
+    :return: (offsets, nodes, weights, middles)
+    '''
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum([len(row) for row in rows], out=offsets[1:])
+    edges = [edge for row in rows for edge in row]
+    return (offsets, np.array([e[0] for e in edges], dtype=np.int64), np.array([e[1] for e in edges], dtype=np.float64),
+            np.array([e[2] for e in edges], dtype=np.int64))
+
+
+class ContractionHierarchy:
+    """
+    Routing index for the heat graph under one edge weight. Nodes are contracted one at a time, least important
+    first, adding a shortcut edge between two of a node's neighbours whenever the only shortest path between them ran
+    through it. A query then only searches upwards in that order from both ends, which settles a few hundred nodes
+    instead of a large part of the city.
+
+    up_* holds, per node, the edges to nodes contracted after it and down_* the edges from nodes contracted after it,
+    in CSR form like the route store. A shortcut's middle is the node it skips (-1 for edges of the graph), so routes
+    are unpacked back to the full list of osm nodes. Build once per weight with build / load_or_build, queries need
+    neither the graph nor NetworkX.
+    """
+
+    def __init__(self, arrays, weight=None, fingerprint=None, weights_hash=None):
+        for name in HIERARCHY_ARRAYS:
+            setattr(self, name, np.asarray(arrays[name]))
+        self.weight = weight
+        self.fingerprint = fingerprint
+        self.weights_hash = weights_hash
+        self.node_order = np.argsort(self.node_ids)
+        # python lists of (node, weight) per node, indexing numpy arrays in the search loop is several times slower
+        self._up = self._adjacency(self.up_offsets, self.up_targets, self.up_weights)
+        self._down = self._adjacency(self.down_offsets, self.down_sources, self.down_weights)
+        self._middles = None
+
+    @staticmethod
+    def _adjacency(offsets, nodes, weights):
+        nodes = nodes.tolist()
+        weights = weights.tolist()
+        offsets = offsets.tolist()
+        return [list(zip(nodes[offsets[i]:offsets[i + 1]], weights[offsets[i]:offsets[i + 1]]))
+                for i in range(len(offsets) - 1)]
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    @classmethod
+    def build(cls, graph, weight=None, fingerprint=None, weights_hash=None, witness_settle_limit=50):
+        '''
+        Contract every node of a routing graph
+        :param graph: RoutingGraph with the edge weight to index
+        :param weight: Name of the edge weight, saved with the hierarchy
+        :param fingerprint: Fingerprint of the graph, see EdgeCostTable.fingerprint
+        :param weights_hash: Hash of the edge weights, see weight_hash
+        :param witness_settle_limit: Nodes a witness search settles before giving up and adding the shortcut. Lower
+                                     builds faster but adds shortcuts that are not needed, queries stay correct
+        '''
+        n = len(graph.node_ids)
+        matrix = graph.matrix.tocoo()
+        out_edges = [{} for _ in range(n)]
+        in_edges = [{} for _ in range(n)]
+        for u, v, w in zip(matrix.row.tolist(), matrix.col.tolist(), matrix.data.tolist()):
+            out_edges[u][v] = w
+            in_edges[v][u] = w
+        middles = {}
+        contracted_neighbours = [0] * n
+
+        def witness_distances(source, skip, max_cost):
+            """Tentative distances of a Dijkstra search from source that avoids skip, up to max_cost"""
+            distances = {source: 0.0}
+            heap = [(0.0, source)]
+            settled = 0
+            while heap and settled < witness_settle_limit:
+                d, node = heapq.heappop(heap)
+                if d > max_cost:
+                    break
+                if d > distances[node]:
+                    continue
+                settled += 1
+                for target, w in out_edges[node].items():
+                    if target != skip and d + w < distances.get(target, np.inf):
+                        distances[target] = d + w
+                        heapq.heappush(heap, (d + w, target))
+            return distances
+
+        def shortcuts(node):
+            """(source, target, cost) shortcuts needed to contract node now"""
+            needed = []
+            for source, w_in in in_edges[node].items():
+                costs = {target: w_in + w_out for target, w_out in out_edges[node].items() if target != source}
+                if not costs:
+                    continue
+                distances = witness_distances(source, node, max(costs.values()))
+                needed.extend((source, target, cost) for target, cost in costs.items()
+                              if distances.get(target, np.inf) > cost)
+            return needed
+
+        def priority(node, needed):
+            # edge difference, plus spreading contractions evenly over the graph
+            return len(needed) - len(in_edges[node]) - len(out_edges[node]) + contracted_neighbours[node]
+
+        heap = [(priority(node, shortcuts(node)), node) for node in range(n)]
+        heapq.heapify(heap)
+        rank = np.zeros(n, dtype=np.int64)
+        up = [None] * n
+        down = [None] * n
+        order = 0
+        while heap:
+            _, node = heapq.heappop(heap)
+            needed = shortcuts(node)
+            # priorities go stale as neighbours are contracted, recheck before contracting
+            current = priority(node, needed)
+            if heap and current > heap[0][0]:
+                heapq.heappush(heap, (current, node))
+                continue
+
+            rank[node] = order
+            order += 1
+            up[node] = [(target, w, middles.get((node, target), -1)) for target, w in out_edges[node].items()]
+            down[node] = [(source, w, middles.get((source, node), -1)) for source, w in in_edges[node].items()]
+            for target in out_edges[node]:
+                del in_edges[target][node]
+                contracted_neighbours[target] += 1
+            for source in in_edges[node]:
+                del out_edges[source][node]
+                contracted_neighbours[source] += 1
+            for source, target, cost in needed:
+                if cost < out_edges[source].get(target, np.inf):
+                    out_edges[source][target] = cost
+                    in_edges[target][source] = cost
+                    middles[(source, target)] = node
+            out_edges[node] = in_edges[node] = None
+
+        arrays = {'node_ids': np.asarray(graph.node_ids), 'rank': rank}
+        arrays.update(zip(('up_offsets', 'up_targets', 'up_weights', 'up_middles'), csr(up, n)))
+        arrays.update(zip(('down_offsets', 'down_sources', 'down_weights', 'down_middles'), csr(down, n)))
+        return cls(arrays, weight, fingerprint, weights_hash)
+
+    @classmethod
+    def from_snapshot(cls, snapshot, weight='travel_time', **kwargs):
+        '''
+        :param snapshot: GraphSnapshot of the heat graph
+        :param weight: Edge weight to index, see routing.edge_weights
+        '''
+        return cls.build(RoutingGraph.from_snapshot(snapshot, weight),
+                         weight=weight if isinstance(weight, str) else None,
+                         fingerprint=snapshot.edge_costs().fingerprint,
+                         weights_hash=weight_hash(edge_weights(snapshot, weight)), **kwargs)
+
+    def save(self, path):
+        meta = json.dumps({'weight': self.weight, 'fingerprint': self.fingerprint, 'weights_hash': self.weights_hash})
+        np.savez(path, meta=np.array(meta), **{name: getattr(self, name) for name in HIERARCHY_ARRAYS})
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            return cls({name: data[name] for name in HIERARCHY_ARRAYS}, meta['weight'], meta['fingerprint'],
+                       meta['weights_hash'])
+
+    @classmethod
+    def load_or_build(cls, snapshot, path, weight='travel_time', **kwargs):
+        '''
+        Load a saved hierarchy, rebuilding it if it was built for another graph or other edge weights
+        :param snapshot: GraphSnapshot of the heat graph
+        :param path: File the hierarchy is saved to, see hierarchy_path
+        :param weight: Edge weight to index, see routing.edge_weights
+        '''
+        if os.path.exists(path):
+            hierarchy = cls.load(path)
+            if hierarchy.fingerprint == snapshot.edge_costs().fingerprint and \
+                    hierarchy.weights_hash == weight_hash(edge_weights(snapshot, weight)):
+                return hierarchy
+        hierarchy = cls.from_snapshot(snapshot, weight, **kwargs)
+        hierarchy.save(path)
+        return hierarchy
+
+    def node_index(self, node_ids):
+        """Position of each osm node id in the hierarchy"""
+        return self.node_order[np.searchsorted(self.node_ids, node_ids, sorter=self.node_order)]
+
+    def _search(self, source, target):
+        '''
+        Bidirectional upward search between two node positions
+        :return: (distance, meeting node, forward parents, backward parents), distance is inf with no path
+        '''
+        distances = ({source: 0.0}, {target: 0.0})
+        parents = ({source: -1}, {target: -1})
+        heaps = ([(0.0, source)], [(0.0, target)])
+        edges = (self._up, self._down)
+        best = np.inf
+        meeting = -1
+        while heaps[0] or heaps[1]:
+            for side in (0, 1):
+                heap = heaps[side]
+                if not heap:
+                    continue
+                # neither direction can improve on best once its queue is past it
+                if heap[0][0] >= best:
+                    heap.clear()
+                    continue
+                d, node = heapq.heappop(heap)
+                if d > distances[side][node]:
+                    continue
+                other = distances[1 - side].get(node)
+                if other is not None and d + other < best:
+                    best = d + other
+                    meeting = node
+                for neighbour, w in edges[side][node]:
+                    if d + w < distances[side].get(neighbour, np.inf):
+                        distances[side][neighbour] = d + w
+                        parents[side][neighbour] = node
+                        heapq.heappush(heap, (d + w, neighbour))
+        return best, meeting, parents[0], parents[1]
+
+    def _unpack(self, source, target):
+        """Graph nodes from source to target along a hierarchy edge, without source"""
+        if self._middles is None:
+            # every shortcut by its endpoints, only needed once routes are asked for
+            middles = {}
+            for node in range(len(self)):
+                for i in range(self.up_offsets[node], self.up_offsets[node + 1]):
+                    if self.up_middles[i] >= 0:
+                        middles[(node, int(self.up_targets[i]))] = int(self.up_middles[i])
+                for i in range(self.down_offsets[node], self.down_offsets[node + 1]):
+                    if self.down_middles[i] >= 0:
+                        middles[(int(self.down_sources[i]), node)] = int(self.down_middles[i])
+            self._middles = middles
+        path = []
+        stack = [(source, target)]
+        while stack:
+            a, b = stack.pop()
+            middle = self._middles.get((a, b))
+            if middle is None:
+                path.append(b)
+            else:
+                stack.append((middle, b))
+                stack.append((a, middle))
+        return path
+
+    def distance(self, origin, destination):
+        """Shortest path cost between two osm nodes, inf if there is no path"""
+        source, target = self.node_index([origin, destination]).tolist()
+        return self._search(source, target)[0]
+
+    def route(self, origin, destination):
+        '''
+        Shortest path between two osm nodes
+        :return: List of osm node ids, None if there is no path
+        '''
+        source, target = self.node_index([origin, destination]).tolist()
+        best, meeting, forward, backward = self._search(source, target)
+        if meeting < 0:
+            return None
+        up_path = [meeting]
+        while forward[up_path[-1]] >= 0:
+            up_path.append(forward[up_path[-1]])
+        up_path.reverse()
+        down_path = [meeting]
+        while backward[down_path[-1]] >= 0:
+            down_path.append(backward[down_path[-1]])
+
+        path = [source]
+        for a, b in zip(up_path[:-1] + down_path[:-1], up_path[1:] + down_path[1:]):
+            path.extend(self._unpack(a, b))
+        return self.node_ids[path].tolist()
+
+    def routes(self, origins, destinations):
+        """Shortest path of every od pair, see route"""
+        return [self.route(origin, destination) for origin, destination in zip(origins, destinations)]
+
+
+if __name__ == '__main__':
+    import time
+    from graph_snapshot import GraphSnapshot
+
+    graph_path = "/Users/emmacorbett/PycharmProjects/USE_Lab/src/agent_based_model/ny_bike_graph_heat_included_2.graphml"
+    snapshot = GraphSnapshot.load_or_build(graph_path)
+    for weight in ('travel_time', 'length', 'heat'):
+        start = time.perf_counter()
+        ContractionHierarchy.load_or_build(snapshot, hierarchy_path(graph_path, weight), weight)
+        print("{} hierarchy ready in {:.1f}s".format(weight, time.perf_counter() - start))
@@ -3,6 +3,8 @@ import numpy as np
 from geopy.distance import geodesic
 import networkx as nx
 from scipy import spatial
+from heat_field import save_heat_field
+from graph_snapshot import GraphSnapshot, file_hash, snapshot_path
 
 
 def calculate_distance(lat1, lon1, lat2, lon2):
@@ -53,11 +55,21 @@ tree = spatial.KDTree(lat_lon_coords)
 
 
 node_to_heat_dict = {}
+node_cells = []
 for node in G.nodes:
     index = tree.query([(G.nodes[node]['y'], G.nodes[node]['x'])])
     result = index[1]
     final_ind = ind_map[lat_lon_coords[result[0]]]
     node_to_heat_dict[node] = t2_array[final_ind[0]][final_ind[1]]
+    node_cells.append(final_ind)
 
 nx.set_node_attributes(G, node_to_heat_dict, name='t2')
 ox.save_graphml(G, "ny_bike_graph_heat_included_2.graphml")
+# compact snapshot the model and routing scripts load instead of the graphml, see graph_snapshot.py
+GraphSnapshot.from_graph(G, file_hash("ny_bike_graph_heat_included_2.graphml")).save(snapshot_path("ny_bike_graph_heat_included_2.graphml"))
+
+# t2 at every wrf output hour for each node, used by HourlyHeatField instead of the single t2 attribute above
+t2_hours = np.load("/Users/emmacorbett/PycharmProjects/USE_Lab/data/wrf_heat_maps/aug5_2024/t2_hourly_2.npy")
+t2_times = np.load("/Users/emmacorbett/PycharmProjects/USE_Lab/data/wrf_heat_maps/aug5_2024/t2_times_2.npy")
+cell_rows, cell_cols = np.array(node_cells).T
+save_heat_field("ny_bike_graph_heat_included_2", list(G.nodes), t2_hours[:, cell_rows, cell_cols].T, t2_times)
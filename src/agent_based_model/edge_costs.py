@@ -0,0 +1,138 @@
+import hashlib
+import numpy as np
+
+
+def edge_travel_time(edge_data):
+    '''
+    Travel time in seconds for an osm edge, falling back on speed limit and then average cyclist speed
+    :param edge_data: Attribute dict of the edge
+    '''
+    if 'travel_time' in edge_data and edge_data['travel_time'] and edge_data['travel_time'] > 0:
+        return edge_data['travel_time']
+    max_speed = 15  # average cyclist speed is about 10mph, e-bike about 20
+    if 'speed_kph' in edge_data and edge_data['speed_kph'] and edge_data['speed_kph'] > 0:
+        max_speed = edge_data['speed_kph'] / 3.6  # convert kph to meters ph
+    return edge_data['length'] / max_speed  # meters / meters ph
+
+
+class EdgeCostTable:
+    """
+    Per edge travel time, t2 and heat cost for a heat graph, computed once and shared by RoadAgent, BikerAgent and
+    the headless engine. Edges are identified by their slot in these arrays, edges[slot] is its (u, v, key).
+
+    heat_cost is the heat a biker picks up riding the edge (travel time * t2 at the head node) and road_heat_cost is
+    what a road segment contributes per biker (travel time * t2 at the tail node, only for edges with a geometry,
+    which are the ones that become RoadAgents).
+    """
+
+    def __init__(self, u, v, key, travel_time, t2_tail, t2_head, has_geometry):
+        self.u = u
+        self.v = v
+        self.key = key
+        self.travel_time = travel_time
+        self.t2_tail = t2_tail
+        self.t2_head = t2_head
+        self.has_geometry = has_geometry
+        self.heat_cost = travel_time * t2_head
+        self.road_heat_cost = np.where(has_geometry, travel_time * t2_tail, 0.0)
+        self._edges = None
+        self._pair_lookup = None
+
+    def __len__(self):
+        return len(self.u)
+
+    @property
+    def edges(self):
+        """(u, v, key) of every edge slot, only built once something reports edges by id"""
+        if self._edges is None:
+            self._edges = list(zip(self.u.tolist(), self.v.tolist(), self.key.tolist()))
+        return self._edges
+
+    @property
+    def fingerprint(self):
+        """Hash of the edges and their travel times, identifying the graph routes and caches were computed on"""
+        digest = hashlib.sha1()
+        for array in (self.u, self.v, self.key, self.travel_time):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()[:16]
+
+    def edge_slots(self, u, v):
+        '''
+        Vectorized lookup of the slot of the key 0 edge between pairs of nodes
+        :param u: Array of start node osm ids
+        :param v: Array of end node osm ids
+        :return: Array of edge slots, -1 where the graph has no such edge
+        '''
+        if self._pair_lookup is None:
+            # number every node, then every key 0 edge by (start, end) node number so pairs can be binary searched
+            nodes = np.unique(np.concatenate([self.u, self.v]))
+            slots = np.flatnonzero(self.key == 0)
+            pairs = np.searchsorted(nodes, self.u[slots]) * len(nodes) + np.searchsorted(nodes, self.v[slots])
+            order = np.argsort(pairs)
+            self._pair_lookup = (nodes, pairs[order], slots[order])
+        nodes, pairs, slots = self._pair_lookup
+
+        u_pos = np.minimum(np.searchsorted(nodes, u), len(nodes) - 1)
+        v_pos = np.minimum(np.searchsorted(nodes, v), len(nodes) - 1)
+        query = u_pos * len(nodes) + v_pos
+        found = np.minimum(np.searchsorted(pairs, query), len(pairs) - 1)
+        hit = (nodes[u_pos] == u) & (nodes[v_pos] == v) & (pairs[found] == query)
+        return np.where(hit, slots[found], -1)
+
+    @classmethod
+    def from_graph(cls, G):
+        '''
+        Compute the table for every edge of a graph
+        :param G: Osm network graph with t2 heat values on its nodes
+        '''
+        n = G.number_of_edges()
+        u = np.zeros(n, dtype=np.int64)
+        v = np.zeros(n, dtype=np.int64)
+        key = np.zeros(n, dtype=np.int64)
+        travel_time = np.zeros(n)
+        t2_tail = np.zeros(n)
+        t2_head = np.zeros(n)
+        has_geometry = np.zeros(n, dtype=bool)
+        for slot, (a, b, k, edge_data) in enumerate(G.edges(keys=True, data=True)):
+            u[slot], v[slot], key[slot] = a, b, k
+            travel_time[slot] = edge_travel_time(edge_data)
+            # t2 is heat index measure - see write_data_from_wrf_to_csv.py and create_osm_heat_bike_graph.py
+            t2_tail[slot] = float(G.nodes[a]['t2'])
+            t2_head[slot] = float(G.nodes[b]['t2'])
+            has_geometry[slot] = 'geometry' in edge_data
+        return cls(u, v, key, travel_time, t2_tail, t2_head, has_geometry)
+
+
+class EdgeHeat:
+    """
+    Heat picked up per edge traversal. Without a heat field this is the static cost from the EdgeCostTable, with an
+    HourlyHeatField t2 is looked up at the rider's clock time: at the head node on arrival for the biker and at the
+    tail node on departure for the road segment. Works on a single edge slot or an array of them.
+    """
+
+    def __init__(self, edge_costs, heat_field=None):
+        self.edge_costs = edge_costs
+        self.heat_field = heat_field
+        if heat_field is not None:
+            self.tail_rows = heat_field.node_rows(edge_costs.u)
+            self.head_rows = heat_field.node_rows(edge_costs.v)
+
+    def travel_time(self, slots):
+        return self.edge_costs.travel_time[slots]
+
+    def biker_heat(self, slots, depart):
+        '''
+        :param slots: Edge slot(s) traversed
+        :param depart: Clock time(s) in seconds the bikers started along the edge
+        '''
+        if self.heat_field is None:
+            return self.edge_costs.heat_cost[slots]
+        time = self.edge_costs.travel_time[slots]
+        return time * self.heat_field.lookup(self.head_rows[slots], depart + time)
+
+    def road_heat(self, slots, depart):
+        if self.heat_field is None:
+            return self.edge_costs.road_heat_cost[slots]
+        time = self.edge_costs.travel_time[slots]
+        heat = time * self.heat_field.lookup(self.tail_rows[slots], depart)
+        return np.where(self.edge_costs.has_geometry[slots], heat, 0.0)
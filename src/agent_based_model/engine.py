@@ -0,0 +1,354 @@
+import numpy as np
+from edge_costs import EdgeHeat
+from graph_snapshot import graph_edge_costs, node_coordinates
+from routes import TripRoutes, as_route_store
+
+# everything that changes as the engine steps, what a checkpoint needs to resume a run
+ENGINE_STATE = ('cursor', 'active', 'x', 'y', 'heat', 'clock', 'exposure', 'road_heat', 'road_exposure')
+
+
+class HeadlessEngine:
+    """
+    Vectorized biker simulation behind BikerModel, which only mirrors these arrays onto mesa agents for display.
+
+    Every route is held in CSR form: route_nodes / route_edges are the concatenated node and edge indices of all
+    routes and node_offsets / edge_offsets give where each route starts. Each biker's route, cursor, position and
+    heat are NumPy vectors, so one tick advances every biker with a handful of array operations.
+
+    By default a step moves every biker one node. With step_seconds a step covers that many simulated seconds and
+    moves every biker that arrives at a node by then, by the travel time of each edge, jumping straight to the next
+    arrival when no one arrives in the window. With departures there is a biker per trip, which sets off at its
+    start time and stops being stepped when it arrives.
+    """
+
+    def __init__(self, G, routes, edge_costs=None, heat_field=None, weight_by_trip_count=False, step_seconds=None,
+                 departures=None, start_time=None):
+        '''
+        Create a new headless engine.
+        :param G: Osm network graph with t2 heat values on its nodes, or its GraphSnapshot
+        :param routes: RouteStore or list of (origin_osm_node, route, trip_count) tuples, see routes.load_routes
+        :param edge_costs: EdgeCostTable for G, computed from G if not given
+        :param heat_field: Optional HourlyHeatField to look t2 up at each biker's clock time instead of the static t2
+        :param weight_by_trip_count: Count each biker as trip_count riders in the road heat
+        :param step_seconds: Simulated seconds each step covers, None to move every biker one node per step
+        :param departures: routes.Departures to run a biker per trip from when it sets off, step_seconds defaults to
+                           60 with departures
+        :param start_time: Time the clock starts at with departures, defaults to the heat field's start time or else
+                           the first departure
+        '''
+        self.G = G
+        self.edge_costs = edge_costs if edge_costs is not None else graph_edge_costs(G)
+        self.edge_heat = EdgeHeat(self.edge_costs, heat_field)
+
+        self.node_ids, self.node_x, self.node_y = node_coordinates(G)
+
+        self.routes = as_route_store(routes)
+        self.route_lengths = self.routes.lengths
+        self.node_offsets = np.asarray(self.routes.offsets)
+        self.edge_offsets = self.node_offsets[:-1] - np.arange(len(self.routes), dtype=np.int64)
+
+        nodes = np.asarray(self.routes.nodes)
+        node_order = np.argsort(self.node_ids)
+        positions = np.minimum(np.searchsorted(self.node_ids, nodes, sorter=node_order), len(self.node_ids) - 1)
+        self.route_nodes = node_order[positions]
+        # routes from another graph only warn in RouteStore.check_graph, their nodes may not be in this one
+        missing = self.node_ids[self.route_nodes] != nodes
+        if np.any(missing):
+            raise ValueError("Route nodes missing from the graph: {}".format(np.unique(nodes[missing]).tolist()))
+        # a route's hops start at each of its nodes but the last
+        hop_start = np.delete(np.arange(len(nodes)), self.node_offsets[1:] - 1)
+        # -1 marks a hop with no edge in the graph, the biker waits there for that step
+        self.route_edges = self.edge_costs.edge_slots(nodes[hop_start], nodes[hop_start + 1])
+
+        self.departures = departures
+        if departures is not None and step_seconds is None:
+            step_seconds = 60
+        self.step_seconds = step_seconds
+        if departures is None:
+            # a biker per route, all setting off at clock 0
+            self.biker_route = np.arange(len(self.routes))
+            self.biker_routes = self.routes
+            self.trip_count = np.asarray(self.routes.trip_count, dtype=np.float64)
+            # riders each biker stands for when adding to road heat
+            self.trip_weight = self.trip_count if weight_by_trip_count else np.ones(len(self.routes))
+            start_clock = np.zeros(len(self.routes))
+        else:
+            self.biker_route = np.asarray(departures.route, dtype=np.int64)
+            self.biker_routes = TripRoutes(self.routes, departures)
+            self.trip_count = np.ones(len(departures))
+            self.trip_weight = self.trip_count
+            if start_time is None:
+                # both are seconds since the epoch
+                start = heat_field.start if heat_field is not None else departures.start[0]
+                start_time = np.datetime64(int(start), 's')
+            self.departure_seconds = departures.seconds_since(start_time)
+            start_clock = self.departure_seconds.astype(np.float64)
+        bikers = len(self.biker_route)
+
+        self.cursor = np.zeros(bikers, dtype=np.int64)
+        # bikers with hops left to ride, retired as they reach the end of their route so late steps only touch the
+        # few long routes still going
+        self.active = np.flatnonzero(self.route_lengths[self.biker_route] > 1) if departures is None else \
+            np.zeros(0, dtype=np.int64)
+        # index of the next biker to set off, they all set off at the start without departures
+        self.next_departure = bikers if departures is None else 0
+        # every biker has finished once the longest route has had a step per node
+        self.total_steps = int(self.route_lengths.max()) if len(self.routes) else 0
+        start = self.route_nodes[self.node_offsets[:-1][self.biker_route]]
+        self.x = self.node_x[start]
+        self.y = self.node_y[start]
+        self.heat = np.zeros(bikers)
+        # clock time of each biker in seconds, advanced by the travel time of every edge
+        self.clock = start_clock
+        # seconds each biker has been riding
+        self.exposure = np.zeros(bikers)
+        self.road_heat = np.zeros(len(self.edge_costs))
+        # seconds ridden on each edge, summed over riders like road_heat, for ranking roads by heat per exposure time
+        self.road_exposure = np.zeros(len(self.edge_costs))
+        self.road_slots = np.flatnonzero(self.edge_costs.has_geometry)
+        self.steps = 0
+        # simulated seconds since the start, with step_seconds
+        self.time = 0.0
+        # bikers moved and edges ridden in the last step, for profiling
+        self.agents_stepped = 0
+        self.edges_touched = 0
+        # every edge ridden in the last step, the biker that rode it and the road heat it added, for step output
+        self.moved = np.zeros(0, dtype=np.int64)
+        self.moved_edges = np.zeros(0, dtype=np.int64)
+        self.moved_road_heat = np.zeros(0)
+        # bikers that set off and that reached the end of their route in the last step
+        self.departed = np.zeros(0, dtype=np.int64)
+        self.arrived = np.zeros(0, dtype=np.int64)
+
+    @property
+    def finished(self):
+        if self.step_seconds is None:
+            return self.steps >= self.total_steps
+        return len(self.active) == 0 and self.next_departure == len(self.biker_route)
+
+    def step(self):
+        """Advance every biker one node along its route, or by the next step_seconds of travel."""
+        self.departed = np.zeros(0, dtype=np.int64)
+        arrived = []
+        if self.step_seconds is None:
+            self.agents_stepped = len(self.active)
+            hops = [self.hop(self.active)]
+        else:
+            self.time += self.step_seconds
+            next_event = self.next_event_time()
+            if next_event is not None and next_event > self.time:
+                # no one arrives or sets off in this step, skip ahead to the next one who does
+                self.time = next_event
+            arrived.append(self.depart())
+            due = self.active[self.next_arrival(self.active) <= self.time]
+            self.agents_stepped = 0
+            hops = []
+            # a biker can ride several short edges in one step, keep hopping the bikers still due
+            while True:
+                self.agents_stepped += len(due)
+                hops.append(self.hop(due))
+                due = due[self.cursor[due] + 1 < self.route_lengths[self.biker_route[due]]]
+                due = due[self.next_arrival(due) <= self.time]
+                if len(due) == 0:
+                    break
+
+        riding = self.cursor[self.active] + 1 < self.route_lengths[self.biker_route[self.active]]
+        arrived.append(self.active[~riding])
+        self.active = self.active[riding]
+        self.arrived = np.concatenate(arrived)
+        self.moved, self.moved_edges, self.moved_road_heat = [np.concatenate(arrays) for arrays in zip(*hops)]
+        self.edges_touched = len(self.moved_edges)
+        self.steps += 1
+
+    def next_event_time(self):
+        """Clock time of the next arrival at a node or trip setting off, None once every biker is done"""
+        times = []
+        if len(self.active) > 0:
+            times.append(self.next_arrival(self.active).min())
+        if self.departures is not None and self.next_departure < len(self.biker_route):
+            times.append(self.departure_seconds[self.next_departure])
+        return float(min(times)) if times else None
+
+    def depart(self):
+        '''
+        Start stepping the bikers of every trip setting off by the end of the current step
+        :return: The bikers that set off with no edge to ride, they arrive straight away
+        '''
+        if self.departures is None:
+            return np.zeros(0, dtype=np.int64)
+        end = int(np.searchsorted(self.departure_seconds, self.time, side='right'))
+        self.departed = np.arange(self.next_departure, end)
+        self.next_departure = end
+        riding = self.route_lengths[self.biker_route[self.departed]] > 1
+        self.active = np.concatenate([self.active, self.departed[riding]])
+        return self.departed[~riding]
+
+    def next_arrival(self, bikers):
+        """Clock time the given bikers reach the next node of their routes, a hop with no edge takes no time"""
+        edges = self.route_edges[self.edge_offsets[self.biker_route[bikers]] + self.cursor[bikers]]
+        travel_time = np.zeros(len(bikers))
+        has_edge = edges >= 0
+        travel_time[has_edge] = self.edge_heat.travel_time(edges[has_edge])
+        return self.clock[bikers] + travel_time
+
+    def hop(self, bikers):
+        '''
+        Move the given bikers one node along their routes, adding the heat of the edges they ride
+        :return: (bikers that rode an edge, the edge slot each rode, the road heat each added)
+        '''
+        routes = self.biker_route[bikers]
+        edges = self.route_edges[self.edge_offsets[routes] + self.cursor[bikers]]
+        moved = edges >= 0
+        riders = bikers[moved]
+        edges = edges[moved]
+
+        depart = self.clock[riders]
+        travel_time = self.edge_heat.travel_time(edges)
+        weight = self.trip_weight[riders]
+        road_heat = self.edge_heat.road_heat(edges, depart) * weight
+        self.heat[riders] += self.edge_heat.biker_heat(edges, depart)
+        np.add.at(self.road_heat, edges, road_heat)
+        np.add.at(self.road_exposure, edges, travel_time * weight)
+        self.clock[riders] = depart + travel_time
+        self.exposure[riders] += travel_time
+
+        next_nodes = self.route_nodes[self.node_offsets[routes[moved]] + self.cursor[riders] + 1]
+        self.x[riders] = self.node_x[next_nodes]
+        self.y[riders] = self.node_y[next_nodes]
+        self.cursor[bikers] += 1
+        return riders, edges, road_heat
+
+    def get_state(self):
+        """Arrays of the engine's state, see ENGINE_STATE"""
+        return {name: getattr(self, name) for name in ENGINE_STATE}
+
+    def set_state(self, state, steps, time=0.0, next_departure=None):
+        '''
+        Resume from a saved state
+        :param state: Dict of the ENGINE_STATE arrays, as returned by get_state
+        :param steps: Number of steps the engine had taken
+        :param time: Simulated seconds the engine had reached, with step_seconds
+        :param next_departure: Next biker to set off, with departures
+        '''
+        self.active = np.asarray(state['active'], dtype=np.int64)
+        for name in ENGINE_STATE:
+            if name != 'active':
+                # in place, BikerModel holds on to some of these arrays
+                getattr(self, name)[:] = state[name]
+        self.steps = steps
+        self.time = time
+        if next_departure is not None:
+            self.next_departure = next_departure
+
+    def results(self, k=20, per_exposure=False):
+        """Heat accumulated so far, see SimulationResults"""
+        return SimulationResults(self.edge_costs.edges, self.road_heat.copy(), self.biker_routes, self.heat.copy(), k,
+                                 road_slots=self.road_slots, trip_count=self.trip_count,
+                                 road_exposure=self.road_exposure.copy(), biker_exposure=self.exposure.copy(),
+                                 per_exposure=per_exposure)
+
+    def hottest_roads(self, k=20, per_exposure=False):
+        """The k hottest road segments so far as ((u, v, key), heat), or heat per second ridden with per_exposure"""
+        return hottest_roads(self.edge_costs.edges, self.road_heat, k, self.road_slots,
+                             self.road_exposure if per_exposure else None)
+
+    def hottest_bikers(self, k=20, per_exposure=False):
+        """The k hottest bikers so far as (route, heat), or heat per second ridden with per_exposure"""
+        return hottest_bikers(self.biker_routes, self.heat, k, self.exposure if per_exposure else None)
+
+    def run_to_completion(self, k=20):
+        '''
+        Step until every biker has reached the end of their route
+        :param k: Number of hottest roads and bikers to report
+        '''
+        while not self.finished:
+            self.step()
+        return self.results(k)
+
+
+def top_k(values, k, candidates=None):
+    '''
+    Indices of the k largest values, ties kept in index order. Only the k values are sorted, the rest are partitioned
+    off in linear time, so this is cheap enough to call every step
+    :param values: Array to rank
+    :param candidates: Optional array of indices to rank, defaults to all of them
+    '''
+    if candidates is None:
+        candidates = np.arange(len(values))
+    ranked = values[candidates]
+    if 0 < k < len(ranked):
+        # everything above the kth largest value, then the first of the values equal to it
+        kth = -np.partition(-ranked, k - 1)[k - 1]
+        above = np.flatnonzero(ranked > kth)
+        tied = np.flatnonzero(ranked == kth)[:k - len(above)]
+        keep = np.sort(np.concatenate([above, tied]))
+        candidates = candidates[keep]
+        ranked = ranked[keep]
+    return candidates[np.argsort(-ranked, kind='stable')[:k]]
+
+
+def exposure_rate(heat, exposure):
+    """Heat per second of exposure, 0 where there has been none"""
+    return np.divide(heat, exposure, out=np.zeros(len(heat)), where=exposure > 0)
+
+
+def hottest_roads(edges, edge_heat, k, road_slots=None, exposure=None):
+    '''
+    The k hottest road segments as ((u, v, key), value)
+    :param road_slots: Edge slots of the road segments, defaults to every edge
+    :param exposure: Seconds ridden per edge, to rank by heat per second instead of total heat
+    '''
+    values = edge_heat if exposure is None else exposure_rate(edge_heat, exposure)
+    return [(edges[slot], values[slot]) for slot in top_k(values, k, road_slots)]
+
+
+def hottest_bikers(routes, biker_heat, k, exposure=None):
+    '''
+    The k hottest bikers as (route, value)
+    :param exposure: Seconds each biker has ridden, to rank by heat per second instead of total heat
+    '''
+    values = biker_heat if exposure is None else exposure_rate(biker_heat, exposure)
+    return [(routes[i], values[i]) for i in top_k(values, k)]
+
+
+class SimulationResults:
+    """
+    Heat accumulated by a run of the biker model.
+
+    edge_heat is indexed by edge slot (edges[slot] is the (u, v, key) edge) and biker_heat by biker, in route order.
+    top_roads and top_bikers are the k hottest road segments and bikers as ((u, v, key), heat) and (route, heat).
+    biker_heat is the exposure of one rider on the route, rider_heat the total over all trip_count riders taking it.
+    With per_exposure the top roads and bikers are ranked, and reported, by heat per second ridden instead.
+    """
+
+    def __init__(self, edges, edge_heat, routes, biker_heat, k=20, road_slots=None, trip_count=None,
+                 road_exposure=None, biker_exposure=None, per_exposure=False):
+        self.edges = edges
+        self.edge_heat = edge_heat
+        self.routes = routes
+        self.biker_heat = biker_heat
+        self.trip_count = trip_count if trip_count is not None else np.ones(len(routes))
+        self.rider_heat = biker_heat * self.trip_count
+        self.total_rider_heat = self.rider_heat.sum()
+        self.road_exposure = road_exposure
+        self.biker_exposure = biker_exposure
+        self.top_roads = hottest_roads(edges, edge_heat, k, road_slots, road_exposure if per_exposure else None)
+        self.top_bikers = hottest_bikers(routes, biker_heat, k, biker_exposure if per_exposure else None)
+
+
+def run_to_completion(G, routes, edge_costs=None, k=20, heat_field=None, weight_by_trip_count=False, step_seconds=None,
+                      departures=None, start_time=None):
+    '''
+    Run a full simulation headlessly and return its results, without any mesa model or files written
+    :param G: Osm network graph with t2 heat values on its nodes
+    :param routes: List of (origin_osm_node, route, trip_count) tuples, see routes.routes_from_frame
+    :param edge_costs: EdgeCostTable for G, pass it in when running many scenarios on one graph
+    :param k: Number of hottest roads and bikers to report
+    :param heat_field: Optional HourlyHeatField for time varying t2
+    :param weight_by_trip_count: Count each route as trip_count riders in the road heat
+    :param step_seconds: Simulated seconds each step covers, None to move every biker one node per step
+    :param departures: routes.Departures to run a biker per trip from when it sets off
+    :param start_time: Time the clock starts at with departures, see HeadlessEngine
+    '''
+    return HeadlessEngine(G, routes, edge_costs, heat_field, weight_by_trip_count, step_seconds, departures,
+                          start_time).run_to_completion(k)
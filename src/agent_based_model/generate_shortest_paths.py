@@ -1,70 +1,71 @@
 
-import os
-import pandas as pd
-from datetime import datetime
-import osmnx as ox
+from citibike_trips import load_trips
+from graph_snapshot import GraphSnapshot
+from heat_routes import HeatRouter, write_heat_routes
+from routes import Departures, routes_from_frame
+from routing import RoutingGraph, shortest_paths
+from stations import station_nodes
 
-G = ox.load_graphml(filepath="/Users/emmacorbett/PycharmProjects/USE_Lab/src/agent_based_model/ny_bike_graph_heat_included_2.graphml")
-dir_name = "/Users/emmacorbett/PycharmProjects/USE_Lab/data/Citibike/5_May_2024"
+# routing runs in worker processes, which import this file again, so the script only runs as main
+if __name__ == '__main__':
+    # route on the graph's snapshot instead of parsing the graphml, see graph_snapshot.py
+    snapshot = GraphSnapshot.load_or_build("/Users/emmacorbett/PycharmProjects/USE_Lab/src/agent_based_model/ny_bike_graph_heat_included_2.graphml")
+    dir_name = "/Users/emmacorbett/PycharmProjects/USE_Lab/data/Citibike/5_May_2024"
 
-# Generate csv with shortest paths routes travelled over 5 times
-dirs = os.listdir(dir_name) # dir_name should be the dir with all the raw citibike csv files
-dataframes = []
-for file in dirs:
-    if file.endswith('.csv'):
-        df_unfiltered = pd.read_csv(dir_name + "/" + file)
-        dataframes.append(df_unfiltered)
+    # every od pair with at least this many trips gets a route - the model weights each route by its trip_count,
+    # so there is no need to cut the table down to the most travelled pairs
+    min_trip_count = 1
+    # also write the heat minimizing route of every od pair and this many alternatives to heat_journey_counts.csv,
+    # None to only write the fastest routes
+    heat_alternatives = None
 
-combined_df = pd.concat(dataframes, ignore_index=True)
-combined_df['started_at'] = pd.to_datetime(combined_df['started_at'])
-combined_df['ended_at'] = pd.to_datetime(combined_df['ended_at'])
-combined_df = combined_df[(combined_df['started_at'].dt.hour >= 11) & (combined_df['started_at'].dt.hour < 14) & (combined_df['end_lng']) & (combined_df['start_lng'])]
+    # Generate csv with shortest paths routes
+    # trips starting midday in the first week of the month, read from the raw citibike csv files in dir_name and
+    # cached as parquet for the next run, see citibike_trips.py
+    df = load_trips(dir_name, columns=['started_at', 'start_station_id', 'end_station_id', 'start_lat', 'start_lng',
+                                       'end_lat', 'end_lng'], start='2024-05-01', end='2024-05-08', hours=(11, 14))
 
-start_date = datetime.strptime('2024-05-01', '%Y-%m-%d').date()
-end_date = datetime.strptime('2024-05-08', '%Y-%m-%d').date()
+    # osm node of every station, snapped once per graph and reused by later months, see stations.py
+    station_node = station_nodes(snapshot, df, snapshot.edge_costs().fingerprint)
+    # keep the start time of every trip, for running the model with bikers created as their trips set off
+    trips = df[['start_station_id', 'end_station_id', 'started_at']]
+    df = df[['start_station_id', 'end_station_id']]
 
-# fileter to midday for the first week of the month
-df = combined_df[(combined_df['started_at'].dt.date >= start_date) & (combined_df['started_at'].dt.date < end_date)]
+    # Group by origin and destination, then count the number of trips
+    od_counts = df.groupby(['start_station_id', 'end_station_id'], observed=True).size().reset_index(name='trip_count')
 
-# save map of station ids to lat/lng values
-lat_lng_map = {}
-for _, row in df.iterrows():
-    lat_lng_map[row['start_station_id']] = (row['start_lat'], row['start_lng'])
-    lat_lng_map[row['end_station_id']] = (row['end_lat'], row['end_lng'])
-df = df[['start_station_id', 'end_station_id']]
+    # Create an origin-destination matrix
+    od_matrix = od_counts.pivot(index='start_station_id', columns='end_station_id', values='trip_count')
 
-# Group by origin and destination, then count the number of trips
-od_counts = df.groupby(['start_station_id', 'end_station_id']).size().reset_index(name='trip_count')
+    # Fill NaN values with 0 (indicating no trips between those stations)
+    od_matrix = od_matrix.fillna(0)
+    od_matrix = od_matrix.stack().reset_index()
+    od_matrix.columns = ['origin', 'destination', 'trip_count']
 
-# Create an origin-destination matrix
-od_matrix = od_counts.pivot(index='start_station_id', columns='end_station_id', values='trip_count')
+    # Sort the DataFrame by trip count in descending order
+    od_flat_sorted = od_matrix.sort_values(by='trip_count', ascending=False)
+    od_flat_sorted = od_flat_sorted[od_flat_sorted['trip_count'] >= min_trip_count]
 
-# Fill NaN values with 0 (indicating no trips between those stations)
-od_matrix = od_matrix.fillna(0)
-od_matrix = od_matrix.stack().reset_index()
-od_matrix.columns = ['origin', 'destination', 'trip_count']
+    # Append shortest route entries
+    origs = station_node.loc[od_flat_sorted['origin'].astype(str)].to_numpy()
+    dests = station_node.loc[od_flat_sorted['destination'].astype(str)].to_numpy()
+    # one search per origin station, spread over all cpus, instead of a separate search for every od pair
+    routes = shortest_paths(RoutingGraph.from_snapshot(snapshot, weight="travel_time"), origs, dests)
+    od_flat_sorted['shortest_path'] = routes
+    od_flat_sorted['origin_osm_node'] = origs
+    # save final csv for the od pairs, number riders, and shortest path calculated
+    # 95566 unique od pairs in total with at least one trip for may 2024 data
+    # 1548 unique od pairs with greater than 5 trips for may 2024 data
+    od_flat_sorted.to_csv('top_journey_counts.csv', index=False)
 
-# Sort the DataFrame by trip count in descending order
-od_flat_sorted = od_matrix.sort_values(by='trip_count', ascending=False)
-od_flat_sorted = od_flat_sorted[od_flat_sorted['trip_count'] > 5.0]
+    # save the same routes as a binary route store the model memory maps at startup, see routes.RouteStore
+    route_store = routes_from_frame(od_flat_sorted, fingerprint=snapshot.edge_costs().fingerprint)
+    route_store.save('top_journey_routes')
+    # and every trip's route and start time, see routes.Departures
+    Departures.from_trips(trips, route_store).save('top_journey_departures')
 
-# Append shortest route entries
-routes = []
-origs = []
-for _, row in od_flat_sorted.iterrows():
-    start_lng = lat_lng_map[row['origin']][1]
-    start_lat = lat_lng_map[row['origin']][0]
-    end_lng = lat_lng_map[row['destination']][1]
-    end_lat = lat_lng_map[row['destination']][0]
-    # code to calculate and save shortest path information on first run
-    orig = ox.distance.nearest_nodes(G, X=start_lng, Y=start_lat)
-    dest = ox.distance.nearest_nodes(G, X=end_lng, Y=end_lat)
-    route = ox.shortest_path(G, orig, dest, weight="travel_time")
-    origs.append(orig)
-    routes.append(route)
-od_flat_sorted['shortest_path'] = routes
-od_flat_sorted['origin_osm_node'] = origs
-# save final csv for the od pairs, number riders, and shortest path calculated
-# 95566 unique od pairs in total with at least one trip for may 2024 data
-# 1548 unique od pairs with greater than 5 trips for may 2024 data
-od_flat_sorted.to_csv('top_journey_counts.csv', index=False)
\ No newline at end of file
+    if heat_alternatives is not None:
+        # see heat_routes.py, read_heat_routes gives the model the coolest routes or the i-th alternatives
+        od_pairs = od_flat_sorted[['origin', 'destination', 'trip_count', 'origin_osm_node']].assign(
+            destination_osm_node=dests)
+        write_heat_routes(HeatRouter(snapshot, k=heat_alternatives), od_pairs, 'heat_journey_counts.csv')
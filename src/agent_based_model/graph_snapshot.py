@@ -0,0 +1,193 @@
+import hashlib
+import json
+import os
+import numpy as np
+import networkx as nx
+import osmnx as ox
+import shapely
+from edge_costs import EdgeCostTable
+
+NODE_ARRAYS = ('node_ids', 'x', 'y', 't2')
+EDGE_ARRAYS = ('u', 'v', 'key', 'length', 'speed_kph', 'travel_time', 'osmid_values', 'osmid_offsets',
+               'geometry_wkb', 'geometry_offsets')
+
+
+def snapshot_path(graph_path):
+    """Directory of the snapshot saved alongside a graphml file"""
+    return os.path.splitext(graph_path)[0] + "_snapshot"
+
+
+def file_hash(path):
+    """Sha1 of a file's contents"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class GraphSnapshot:
+    """
+    The parts of the heat graph the model and routing use, as flat NumPy arrays: node ids, coordinates and t2, and
+    per edge (in G.edges(keys=True) order, so edge slots match EdgeCostTable) the endpoints, length, speed_kph,
+    travel_time (nan where missing), osmids and WKB geometry. osmids and geometries are variable length, so they
+    are stored concatenated with offsets like the route store.
+
+    Built once from the graphml and saved as a directory of .npy files that open memory mapped, along with the
+    hash of the graphml it was built from. The NetworkX graph is only rebuilt by to_networkx when it is needed,
+    e.g. for routing.
+    """
+
+    def __init__(self, arrays, crs="epsg:4326", source_hash=None):
+        for name in NODE_ARRAYS + EDGE_ARRAYS:
+            setattr(self, name, arrays[name])
+        self.crs = crs
+        self.source_hash = source_hash
+        self.node_order = np.argsort(self.node_ids)
+        self._edge_costs = None
+
+    def number_of_nodes(self):
+        return len(self.node_ids)
+
+    def number_of_edges(self):
+        return len(self.u)
+
+    @classmethod
+    def from_graph(cls, G, source_hash=None):
+        '''
+        Flatten an osm heat graph into a snapshot
+        :param G: Osm network graph with t2 heat values on its nodes
+        :param source_hash: Hash of the graphml file G was loaded from
+        '''
+        nodes = list(G.nodes(data=True))
+        arrays = {
+            'node_ids': np.array([n for n, _ in nodes], dtype=np.int64),
+            'x': np.array([data['x'] for _, data in nodes], dtype=np.float64),
+            'y': np.array([data['y'] for _, data in nodes], dtype=np.float64),
+            't2': np.array([float(data.get('t2', np.nan)) for _, data in nodes], dtype=np.float64),
+        }
+
+        edges = list(G.edges(keys=True, data=True))
+        arrays['u'] = np.array([u for u, _, _, _ in edges], dtype=np.int64)
+        arrays['v'] = np.array([v for _, v, _, _ in edges], dtype=np.int64)
+        arrays['key'] = np.array([k for _, _, k, _ in edges], dtype=np.int64)
+        arrays['length'] = np.array([data['length'] for _, _, _, data in edges], dtype=np.float64)
+        arrays['speed_kph'] = np.array([data.get('speed_kph') or np.nan for _, _, _, data in edges], dtype=np.float64)
+        arrays['travel_time'] = np.array([data.get('travel_time') or np.nan for _, _, _, data in edges],
+                                         dtype=np.float64)
+
+        osmids = [data['osmid'] if isinstance(data['osmid'], list) else [data['osmid']] for _, _, _, data in edges]
+        arrays['osmid_values'] = np.array([osmid for ids in osmids for osmid in ids], dtype=np.int64)
+        arrays['osmid_offsets'] = np.concatenate([[0], np.cumsum([len(ids) for ids in osmids])]).astype(np.int64)
+
+        wkb = [shapely.to_wkb(data['geometry']) if 'geometry' in data else b'' for _, _, _, data in edges]
+        arrays['geometry_wkb'] = np.frombuffer(b''.join(wkb), dtype=np.uint8)
+        arrays['geometry_offsets'] = np.concatenate([[0], np.cumsum([len(b) for b in wkb])]).astype(np.int64)
+        return cls(arrays, G.graph.get('crs', "epsg:4326"), source_hash)
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for name in NODE_ARRAYS + EDGE_ARRAYS:
+            np.save(os.path.join(path, name + '.npy'), getattr(self, name))
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({'crs': str(self.crs), 'source_hash': self.source_hash}, f)
+
+    @classmethod
+    def open(cls, path):
+        """Memory map a snapshot written by save"""
+        arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in NODE_ARRAYS + EDGE_ARRAYS}
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        return cls(arrays, meta['crs'], meta['source_hash'])
+
+    @classmethod
+    def load_or_build(cls, graph_path):
+        '''
+        Open the snapshot saved next to a graphml file, rebuilding it when the graphml contents have changed
+        :param graph_path: Path of the heat graph graphml file
+        '''
+        path = snapshot_path(graph_path)
+        source_hash = file_hash(graph_path)
+        if os.path.exists(os.path.join(path, 'meta.json')):
+            snapshot = cls.open(path)
+            if snapshot.source_hash == source_hash:
+                return snapshot
+        snapshot = cls.from_graph(ox.load_graphml(filepath=graph_path), source_hash)
+        snapshot.save(path)
+        return cls.open(path)
+
+    def node_index(self, node_ids):
+        """Position of each osm node id in the node arrays"""
+        return self.node_order[np.searchsorted(self.node_ids, node_ids, sorter=self.node_order)]
+
+    def osmid(self, slot):
+        """Osm way id of an edge, a list when the edge was simplified from several ways"""
+        ids = self.osmid_values[self.osmid_offsets[slot]:self.osmid_offsets[slot + 1]].tolist()
+        return ids[0] if len(ids) == 1 else ids
+
+    def geometries(self, slots):
+        """Shapely geometries of the given edge slots, None for edges without a geometry"""
+        wkb = [self.geometry_wkb[self.geometry_offsets[slot]:self.geometry_offsets[slot + 1]].tobytes() or None
+               for slot in slots]
+        return shapely.from_wkb(wkb)
+
+    def edge_travel_times(self):
+        """Travel time of every edge with the same fallbacks as edge_costs.edge_travel_time"""
+        speed = np.where(self.speed_kph > 0, self.speed_kph / 3.6, 15)
+        return np.where(self.travel_time > 0, self.travel_time, self.length / speed)
+
+    def edge_costs(self):
+        """EdgeCostTable of the graph, straight from the arrays. Built on the first call and shared after"""
+        if self._edge_costs is None:
+            t2 = self.t2[self.node_index(self.u)], self.t2[self.node_index(self.v)]
+            has_geometry = np.diff(self.geometry_offsets) > 0
+            self._edge_costs = EdgeCostTable(np.asarray(self.u), np.asarray(self.v), np.asarray(self.key),
+                                             self.edge_travel_times(), t2[0], t2[1], has_geometry)
+        return self._edge_costs
+
+    def to_networkx(self):
+        """Rebuild the osmnx MultiDiGraph, with the node and edge attributes held in the snapshot"""
+        G = nx.MultiDiGraph(crs=self.crs)
+        G.add_nodes_from((n, {'x': x, 'y': y, 't2': t2}) for n, x, y, t2 in
+                         zip(self.node_ids.tolist(), self.x.tolist(), self.y.tolist(), self.t2.tolist()))
+        geometries = self.geometries(range(self.number_of_edges()))
+        for slot, (u, v, key) in enumerate(zip(self.u.tolist(), self.v.tolist(), self.key.tolist())):
+            data = {'length': float(self.length[slot]), 'osmid': self.osmid(slot)}
+            if self.speed_kph[slot] > 0:
+                data['speed_kph'] = float(self.speed_kph[slot])
+            if self.travel_time[slot] > 0:
+                data['travel_time'] = float(self.travel_time[slot])
+            if geometries[slot] is not None:
+                data['geometry'] = geometries[slot]
+            G.add_edge(u, v, key, **data)
+        return G
+
+
+def node_coordinates(G):
+    '''
+    Node ids and coordinates of a graph or snapshot as arrays
+    :return: (node_ids, x, y)
+    '''
+    if isinstance(G, GraphSnapshot):
+        return np.asarray(G.node_ids), np.asarray(G.x), np.asarray(G.y)
+    return (np.array(list(G.nodes), dtype=np.int64), np.array([G.nodes[n]['x'] for n in G.nodes], dtype=np.float64),
+            np.array([G.nodes[n]['y'] for n in G.nodes], dtype=np.float64))
+
+
+def graph_edge_costs(G):
+    """EdgeCostTable for a NetworkX graph or a GraphSnapshot"""
+    if isinstance(G, GraphSnapshot):
+        return G.edge_costs()
+    return EdgeCostTable.from_graph(G)
+
+
+def road_segments(G, edge_costs):
+    '''
+    Every edge with a geometry, which become the RoadAgents
+    :return: (edge slots, geometries, osmids)
+    '''
+    slots = np.flatnonzero(edge_costs.has_geometry)
+    if isinstance(G, GraphSnapshot):
+        return slots, G.geometries(slots), [G.osmid(slot) for slot in slots]
+    edge_data = [G.edges[edge_costs.edges[slot]] for slot in slots]
+    return slots, [data['geometry'] for data in edge_data], [data['osmid'] for data in edge_data]
@@ -0,0 +1,74 @@
+import numpy as np
+
+
+def heat_field_paths(name):
+    """Paths of the node x hour t2 matrix and its node id / hour index for a heat field saved under name"""
+    return name + "_t2_hourly.npy", name + "_t2_hourly_index.npz"
+
+
+def save_heat_field(name, node_ids, t2, hours):
+    '''
+    Save hourly t2 values for every node of an osm graph
+    :param name: Path prefix to save the heat field under, e.g. the graphml path without extension
+    :param node_ids: Osm ids of the nodes, in the row order of t2
+    :param t2: Array of shape (nodes, hours) with the t2 value of the wrf cell closest to each node
+    :param hours: Times of the wrf outputs, one per column of t2
+    '''
+    t2_path, index_path = heat_field_paths(name)
+    np.save(t2_path, np.asarray(t2, dtype=np.float32))
+    np.savez(index_path, node_ids=np.asarray(node_ids, dtype=np.int64),
+             hours=np.asarray(hours, dtype='datetime64[s]').astype(np.int64))
+
+
+class HourlyHeatField:
+    """
+    T2 for every node of the graph at every wrf output hour, replacing the single t2 node attribute when heat should
+    follow the time of day. The node x hour matrix is memory mapped, so only the rows bikers actually look up are read.
+
+    Times are seconds since start_time, the simulated clock the bikers keep. Each lookup uses the latest wrf output at
+    or before that time, clamped to the first and last hour.
+    """
+
+    def __init__(self, t2, node_ids, hours, start_time):
+        '''
+        :param t2: Array of shape (nodes, hours)
+        :param node_ids: Osm ids of the nodes, in the row order of t2
+        :param hours: Wrf output times as seconds since the epoch, one per column of t2
+        :param start_time: Time the simulation clock starts at, anything np.datetime64 accepts
+        '''
+        self.t2 = t2
+        self.node_ids = node_ids
+        self.hours = hours
+        self.start = np.datetime64(start_time, 's').astype(np.int64)
+        self.sorter = np.argsort(node_ids)
+
+    @classmethod
+    def load(cls, name, start_time):
+        t2_path, index_path = heat_field_paths(name)
+        with np.load(index_path) as index:
+            node_ids = index['node_ids']
+            hours = index['hours']
+        return cls(np.load(t2_path, mmap_mode='r'), node_ids, hours, start_time)
+
+    def node_rows(self, node_ids):
+        """Row of each of the given osm node ids in the t2 matrix"""
+        node_ids = np.asarray(node_ids)
+        positions = np.minimum(np.searchsorted(self.node_ids, node_ids, sorter=self.sorter), len(self.node_ids) - 1)
+        rows = self.sorter[positions]
+        missing = self.node_ids[rows] != node_ids
+        if np.any(missing):
+            raise ValueError("Nodes missing from the heat field: {}".format(np.unique(node_ids[missing]).tolist()))
+        return rows
+
+    def hour_index(self, seconds):
+        """Column of the wrf output in effect at the given number of seconds after start_time"""
+        index = np.searchsorted(self.hours, self.start + np.asarray(seconds), side='right') - 1
+        return np.clip(index, 0, len(self.hours) - 1)
+
+    def lookup(self, rows, seconds):
+        '''
+        T2 at the given node rows and clock times
+        :param rows: Rows from node_rows
+        :param seconds: Seconds after start_time, one per row or a single time for all of them
+        '''
+        return self.t2[rows, self.hour_index(seconds)]
@@ -0,0 +1,167 @@
+import numpy as np
+import pandas as pd
+from scipy.sparse.csgraph import dijkstra
+from routes import routes_from_frame
+from routing import RoutingGraph, routes_by_origin, tree_path
+
+# output of generate_shortest_paths.py with heat_alternatives set
+HEAT_ROUTE_TABLE_PATH = "/Users/emmacorbett/PycharmProjects/USE_Lab/src/agent_based_model/heat_journey_counts.csv"
+HEAT_ROUTE_COLUMNS = ['origin', 'destination', 'trip_count', 'shortest_path', 'origin_osm_node', 'alternative',
+                      'length', 'travel_time', 'heat', 'extra_length', 'extra_travel_time', 'extra_heat']
+
+
+class HeatRouter:
+    """
+    Heat minimizing routes, with travel time * t2 at the head node as the edge weight (the heat a biker picks up,
+    see EdgeCostTable.heat_cost), and up to k alternatives to each.
+
+    Alternatives are via node routes: the coolest route from the origin to a node followed by the coolest route from
+    it to the destination, from one search out of the origin shared by all its destinations and one search back from
+    each destination. Via nodes are tried from coolest to hottest, keeping routes that are at most max_stretch hotter
+    than the coolest, have no loops and share at most max_sharing of their heat with the routes already kept. Unlike
+    enumerating k shortest paths this never branches off every node of every route, so work and memory per od pair
+    are bounded by the two searches and max_candidates route checks.
+    """
+
+    def __init__(self, snapshot, k=3, max_stretch=0.25, max_sharing=0.8, max_candidates=50):
+        '''
+        :param snapshot: GraphSnapshot of the heat graph
+        :param k: Alternatives to find per od pair, besides the coolest route
+        :param max_stretch: How much hotter than the coolest route an alternative may be, as a fraction
+        :param max_sharing: Fraction of an alternative's heat that may be on roads of routes already kept
+        :param max_candidates: Via nodes to check per od pair before giving up on finding k alternatives
+        '''
+        self.heat_graph = RoutingGraph.from_snapshot(snapshot, weight='heat')
+        self.fastest_graph = RoutingGraph.from_snapshot(snapshot, weight='travel_time')
+        # searches back from a destination run on the graph with every edge reversed
+        self.reverse_matrix = self.heat_graph.matrix.transpose().tocsr()
+        self.edge_costs = snapshot.edge_costs()
+        self.length = np.asarray(snapshot.length, dtype=np.float64)
+        self.k = k
+        self.max_stretch = max_stretch
+        self.max_sharing = max_sharing
+        self.max_candidates = max_candidates
+
+    def node_index(self, node_ids):
+        return self.heat_graph.node_index(node_ids)
+
+    def edge_slots(self, route):
+        """Edge slots the model rides along a route of node positions, without edges missing from the graph"""
+        node_ids = self.heat_graph.node_ids[route]
+        slots = self.edge_costs.edge_slots(node_ids[:-1], node_ids[1:])
+        return slots[slots >= 0]
+
+    def route_costs(self, route):
+        """(length, travel time, heat) of a route of node positions, as the model would count them"""
+        slots = self.edge_slots(route)
+        return (float(self.length[slots].sum()), float(self.edge_costs.travel_time[slots].sum()),
+                float(self.edge_costs.heat_cost[slots].sum()))
+
+    def alternatives(self, origin, destination, distances, predecessors):
+        '''
+        Coolest route between two nodes and up to k alternatives
+        :param origin: Node position of the origin
+        :param destination: Node position of the destination
+        :param distances: Heat of the coolest route from origin to every node
+        :param predecessors: Predecessor tree of that search
+        :return: List of routes as node positions, coolest first
+        '''
+        coolest = tree_path(predecessors, origin, destination)
+        routes = [coolest]
+        if self.k == 0 or len(coolest) < 2:
+            return routes
+        bound = distances[destination] * (1 + self.max_stretch)
+        back_distances, back_predecessors = dijkstra(self.reverse_matrix, indices=destination,
+                                                     return_predecessors=True, limit=bound)
+        via_heat = distances + back_distances
+        candidates = np.flatnonzero(via_heat <= bound)
+        candidates = candidates[np.argsort(via_heat[candidates], kind='stable')]
+
+        on_routes = set(coolest)
+        kept_slots = self.edge_slots(coolest)
+        checked = 0
+        for via in candidates.tolist():
+            if len(routes) > self.k or checked >= self.max_candidates:
+                break
+            # any via node on a kept route just gives that route back
+            if via in on_routes:
+                continue
+            checked += 1
+            head = tree_path(predecessors, origin, via)
+            tail = tree_path(back_predecessors, destination, via)[::-1]
+            # the two halves cross, the route would loop
+            if set(head).intersection(tail[1:]):
+                continue
+            route = head + tail[1:]
+            slots = self.edge_slots(route)
+            heat = self.edge_costs.heat_cost[slots]
+            if heat.sum() > 0 and heat[np.isin(slots, kept_slots)].sum() / heat.sum() > self.max_sharing:
+                continue
+            routes.append(route)
+            on_routes.update(route)
+            kept_slots = np.concatenate([kept_slots, slots])
+        return routes
+
+    def paths_from(self, origin, destinations):
+        '''
+        Fastest route, coolest route and alternatives from one origin to many destinations, see routing.routes_by_origin
+        :return: For each destination None if it can't be reached, else (fastest route costs, [(route as osm node
+                 ids, length, travel time, heat) of the coolest route and each alternative])
+        '''
+        distances, predecessors = dijkstra(self.heat_graph.matrix, indices=origin, return_predecessors=True)
+        fastest_distances, fastest_predecessors = dijkstra(self.fastest_graph.matrix, indices=origin,
+                                                           return_predecessors=True)
+        results = []
+        for destination in destinations:
+            if not np.isfinite(distances[destination]):
+                results.append(None)
+                continue
+            fastest = self.route_costs(tree_path(fastest_predecessors, origin, destination))
+            routes = self.alternatives(origin, destination, distances, predecessors)
+            results.append((fastest, [(self.heat_graph.node_ids[route].tolist(),) + self.route_costs(route)
+                                      for route in routes]))
+        return results
+
+
+def write_heat_routes(router, od_pairs, path, processes=None, origins_per_task=16):
+    '''
+    Write the coolest route and alternatives of every od pair as a route table, one row per route with its rank in
+    alternative (0 for the coolest route) and its length, travel time and heat, also as extra over the fastest route.
+    Rows are appended as each origin finishes, so memory doesn't grow with the number of od pairs.
+    :param router: HeatRouter
+    :param od_pairs: DataFrame with the origin, destination and trip_count of each od pair and the osm nodes of its
+                     stations in origin_osm_node and destination_osm_node
+    :param path: Csv file to write
+    :return: Number of routes written
+    '''
+    origin = od_pairs['origin'].to_numpy()
+    destination = od_pairs['destination'].to_numpy()
+    trip_count = od_pairs['trip_count'].to_numpy()
+    origin_osm_node = od_pairs['origin_osm_node'].to_numpy()
+    written = 0
+    with open(path, 'w') as f:
+        pd.DataFrame(columns=HEAT_ROUTE_COLUMNS).to_csv(f, index=False)
+        for pairs, results in routes_by_origin(router, od_pairs['origin_osm_node'], od_pairs['destination_osm_node'],
+                                               processes, origins_per_task):
+            rows = []
+            for i, result in zip(pairs.tolist(), results):
+                if result is None:
+                    continue
+                (fastest_length, fastest_travel_time, fastest_heat), routes = result
+                for alternative, (route, length, travel_time, heat) in enumerate(routes):
+                    rows.append((origin[i], destination[i], trip_count[i], route, origin_osm_node[i], alternative,
+                                 length, travel_time, heat, length - fastest_length,
+                                 travel_time - fastest_travel_time, heat - fastest_heat))
+            pd.DataFrame(rows, columns=HEAT_ROUTE_COLUMNS).to_csv(f, header=False, index=False)
+            written += len(rows)
+    return written
+
+
+def read_heat_routes(path=HEAT_ROUTE_TABLE_PATH, alternative=0, fingerprint=None):
+    '''
+    Route store of one rank of route from a table written by write_heat_routes
+    :param alternative: 0 for the coolest route of every od pair, i for the i-th alternative of the pairs that have one
+    :param fingerprint: Fingerprint of the graph the routes were computed on
+    '''
+    table = pd.read_csv(path, dtype={'origin': str, 'destination': str})
+    return routes_from_frame(table[table['alternative'] == alternative], fingerprint=fingerprint)
@@ -1,206 +1,271 @@
 import mesa
 import os
-import pandas as pd
+import time
+import numpy as np
 from agents import BikerAgent, RoadAgent
+from graph_snapshot import graph_edge_costs, road_segments
+from engine import HeadlessEngine
+from routes import as_route_store, load_routes
 import mesa_geo as mg
-from shapely.geometry import Point
-import matplotlib.cm as cm
-from matplotlib.colors import Normalize
+import shapely
+import matplotlib
 from scheduler import CustomScheduler
-from datetime import datetime
-import osmnx as ox
+from profiling import StepProfiler
+from step_output import StepWriter
 import json
 import sys
 
+COLOR_LUT_SIZE = 256
+
+
+def lut_index(values, normalize_values):
+    """
+    Colormap lookup table index for each value, normalized to the range of normalize_values. Matches
+    cmap(Normalize(vmin, vmax)(value)) for a 256 color matplotlib colormap, including clipping out of range values.
+    """
+    if len(normalize_values) < 1:
+        return np.zeros(len(values), dtype=np.int64)
+    vmin = normalize_values.min()
+    vmax = normalize_values.max()
+    if vmin == vmax:
+        return np.zeros(len(values), dtype=np.int64)
+    scaled = (values - vmin) / (vmax - vmin) * COLOR_LUT_SIZE
+    return np.clip(scaled.astype(np.int64), 0, COLOR_LUT_SIZE - 1)
+
+
+def color_indexes(biker_heat, road_heat, road_contribution, steps):
+    '''
+    Colormap lookup table index of every biker and road segment after a step
+    :param biker_heat: Heat of every biker
+    :param road_heat: Heat of every road segment
+    :param road_contribution: Heat each road segment adds per biker, see EdgeCostTable.road_heat_cost
+    :param steps: Steps taken so far
+    :return: (biker indexes, road indexes)
+    '''
+    # cap the hottest heat measurement
+    top = (10000.0 * (steps + 1))
+
+    # bikers are normalized over their (capped) nonzero heat values, roads over the capped heat contribution
+    # of roads that have been travelled
+    heated = biker_heat != 0
+    biker_values = np.minimum(biker_heat[heated], top)
+    heated = road_heat != 0
+    road_values = np.where(road_heat[heated] > top, top, road_contribution[heated])
+
+    # if want full heat contribution of roads, can color with lut_index(road_contribution, road_values)
+    return lut_index(np.minimum(biker_heat, top), biker_values), lut_index(np.minimum(road_heat, top), road_values)
+
+
 class BikerModel(mesa.Model):
     """Model containing biker agents that move throughout NYC accumulating heat indices"""
 
-    def __init__(self, dir_name, G):
+    def __init__(self, dir_name, G, headless=False, edge_costs=None, verbose=False, routes=None, heat_field=None,
+                 weight_by_trip_count=False, step_seconds=None, departures=None, start_time=None, profile=False,
+                 k=20, rank_per_exposure=False, output=None, checkpoint=None, checkpoint_every=None):
+        '''
+        Create a new biker model.
+        :param dir_name: Directory of the raw citibike csv files
+        :param G: Osm network graph with t2 heat values on its nodes, or its GraphSnapshot
+        :param headless: Run the engine without creating any mesa agents to display it
+        :param edge_costs: EdgeCostTable for G, computed from G if not given
+        :param verbose: Print the construction timing report and the hottest biker and road after every step
+        :param routes: RouteStore or list of (origin_osm_node, route, trip_count) tuples, loaded from the route store
+                       written by generate_shortest_paths.py if not given
+        :param heat_field: Optional HourlyHeatField to look t2 up at each biker's clock time, see heat_field.py
+        :param weight_by_trip_count: Let each biker stand for trip_count riders in the road heat, so one agent per
+                                     unique route gives the same road heat as one agent per trip
+        :param step_seconds: Move bikers by the travel time of each edge, covering this many simulated seconds per
+                             step, instead of one node per step, see HeadlessEngine
+        :param departures: routes.Departures to create one biker per trip when it sets off and remove it when it
+                           arrives, instead of one biker per route for the whole run. Runs event driven, with
+                           step_seconds defaulting to 60
+        :param start_time: Time the simulation clock starts at when running departures, defaults to the heat field's
+                           start time or else the first departure
+        :param profile: Record per step phase timings, agent and edge counts and peak memory in self.profiler, see
+                        profiling.StepProfiler
+        :param k: Number of hottest road segments and bikers to report and highlight
+        :param rank_per_exposure: Rank the hottest road segments and bikers by heat per second ridden rather than
+                                  total heat
+        :param output: Directory to write the road heat added and the bikers moved at every step to, see
+                       step_output.StepWriter
+        :param checkpoint: File to save the state of the run to every checkpoint_every steps, see save_checkpoint
+        :param checkpoint_every: Number of steps between checkpoints
+        '''
         super().__init__()
+        # seconds spent on each phase of construction, see construction_report
+        self.construction_times = {}
+        self._construction_clock = time.perf_counter()
         self.num_agents = 0
+        # the schedule only holds the agents, the engine moves them
         self.schedule = CustomScheduler(self)
         self.space = mg.GeoSpace(warn_crs_conversion=True, crs="epsg:4326")
         self.steps = 0
         self.counts = None
         self.G = G
-        self.road_map = {}
         self.isFinished = False
         self.running = True
+        # print the hottest biker and road geometries after every step
+        self.verbose = verbose
+        self.profiler = StepProfiler() if profile else None
+        self.k = k
+        self.rank_per_exposure = rank_per_exposure
+        self.checkpoint = checkpoint
+        self.checkpoint_every = checkpoint_every
 
-        # set up Road segment agents
-        road_creator = mg.AgentCreator(RoadAgent,
-                                       model=self,
-                                       crs=self.space.crs,
-                                       agent_kwargs={"heat_contribution": None,
-                                                     "edge_id": None}
-                                       )
-        # add each edge in the osm network graph to the model
-        for edge in G.edges:
-            edge_data = self.G.edges[edge]
-            if 'geometry' in edge_data:
-                road = road_creator.create_agent(edge_data['geometry'], self.num_agents)
-                # t2 is heat index measure - see write_data_from_wrf_to_csv.py and create_osm_heat_bike_graph.py
-                t2 = float(self.G.nodes[edge[0]]['t2'])
-
-                # get travel time for that edge
-                if 'travel_time' in edge_data and edge_data['travel_time'] and edge_data['travel_time'] > 0:
-                    time = edge_data['travel_time']
-                else:
-                    max_speed = 15  # average cyclist speed is about 10mph, e-bike about 20
-                    if 'speed_kph' in edge_data and edge_data['speed_kph'] and edge_data['speed_kph'] > 0:
-                        max_speed = edge_data['speed_kph'] / 3.6 # convert kph to meters ph
-                    length = edge_data['length']  # returns length in meters
-                    time = length / max_speed # meters / meters ph
-
-                # heat contribution of segment is time travelled times t2 heat index
-                road.heat_contribution = time * t2
-                road.edge_id = edge
-                road.start_node = edge[0]
-                road.end_node = edge[1]
-                road.osmid = edge_data['osmid']
-
-                self.num_agents += 1
-                self.space.add_agents(road)
-                self.schedule.add(road)
-
-        # set up biker agents
-        ac_population = mg.AgentCreator(BikerAgent,
-                                        model=self,
-                                        crs=self.space.crs,
-                                        agent_kwargs={"origin": None,
-                                                      "destination": None,
-                                                      "route": None,
-                                                      "G": G,
-                                                      "trip_count": None}
-                                        )
-
-        bikers = pd.read_csv("/Users/emmacorbett/PycharmProjects/USE_Lab/src/agent_based_model/top_journey_counts.csv")
-        for _, row in bikers.iterrows():
-            if 'shortest_path' in row and row['shortest_path'] and not isinstance(row['shortest_path'], float):
-                orig = row['origin_osm_node']
-                route = row['shortest_path'].strip('][').split(', ')
-                route = [int(x) for x in route]
-
-                # drop journeys that start and end at same location, since we cannot assume their path
-                if len(route) > 1:
-                    x, y = self.G.nodes[orig]['x'], self.G.nodes[orig]['y']
-
-                    a = ac_population.create_agent(Point(x, y), self.num_agents)
-                    a.route = route
-                    a.trip_count = row['trip_count']
-                    self.num_agents += 1
-                    self.space.add_agents(a)
-                    self.schedule.add(a)
+        # per edge travel time and heat costs, indexed by the dense (u, v, key) edge slot shared by bikers and roads
+        self.edge_costs = edge_costs if edge_costs is not None else graph_edge_costs(G)
+        self.record_construction_time('edge costs')
 
-        self.assign_colors()
+        routes = load_routes() if routes is None else as_route_store(routes)
+        routes.check_graph(self.edge_costs)
+        self.routes = routes
+        # with departures there is a biker, and a slot in biker_heat, per trip rather than per route
+        self.departures = departures
+        self.record_construction_time('routes')
 
+        # bikers are stepped all at once in the vectorized engine, the mesa agents only mirror its arrays for display
+        # and headless runs create none
+        self.headless = headless
+        self.engine = HeadlessEngine(G, routes, self.edge_costs, heat_field, weight_by_trip_count, step_seconds,
+                                     departures, start_time)
+        self.trip_count = self.engine.trip_count
+        self.road_heat = self.engine.road_heat
+        self.biker_heat = self.engine.heat
+        self.road_exposure = self.engine.road_exposure
+        # seconds each biker has been riding
+        self.biker_exposure = self.engine.exposure
+        self.record_construction_time('engine')
+        self.output = StepWriter(output, len(self.edge_costs), len(self.trip_count)) if output is not None else None
+        if headless:
+            return
 
-    def assign_colors(self):
-        biker_values = []
-        road_values = []
-        max_bike_val = 0
-        max_road_val = 0
-        max_bike = None
-        max_road = None
-        # cap the hottest heat measurement
-        top = (10000.0 * (self.steps + 1))
-        for agent in self.schedule.agents:
-            if agent.heat_accumulation != 0:
-                if isinstance(agent, BikerAgent):
-                    if agent.heat_accumulation > top:
-                        biker_values.append(top)
-                    else:
-                        biker_values.append(agent.heat_accumulation)
-                    if agent.heat_accumulation > max_bike_val:
-                        max_bike = agent
-                        max_bike_val = agent.heat_accumulation
-                elif isinstance(agent, RoadAgent):
-                    if agent.heat_accumulation > top:
-                        road_values.append(top)
-                    else:
-                        road_values.append(agent.heat_contribution)
-                    if agent.heat_accumulation > max_road_val:
-                        max_road = agent
-                        max_road_val = agent.heat_accumulation
-        #attribute_values = [agent.heat_accumulation for agent in self.schedule.agents if isinstance(agent, BikerAgent) and agent.heat_accumulation != 0]
-
-        if len(road_values) < 1:
-            road_values.append(0)
-        if len(biker_values) < 1:
-            biker_values.append(0)
-        road_values.sort(reverse=True)
-        norm_bike = Normalize(vmin=min(biker_values), vmax=max(biker_values))
-        norm_road = Normalize(vmin=min(road_values), vmax=max(road_values))
-        cmap_bike = cm.get_cmap('Reds')
-        cmap_road = cm.get_cmap('Blues')
+        # set up Road segment agents for each edge in the osm network graph that has a geometry, all at once
+        slots, geometries, osmids = road_segments(G, self.edge_costs)
+        self.road_agents = [RoadAgent(self.num_agents + i, self, geometry, self.space.crs,
+                                      # heat contribution of segment is time travelled times t2, see edge_costs.py
+                                      self.edge_costs.road_heat_cost[slot], self.edge_costs.edges[slot], slot, osmid)
+                            for i, (slot, geometry, osmid) in enumerate(zip(slots.tolist(), geometries, osmids))]
+        self.num_agents += len(self.road_agents)
+        self.record_construction_time('road agents')
 
-        for agent in self.schedule.agents:
-            if isinstance(agent, BikerAgent):
-                if agent.heat_accumulation > top:
-                    agent.color = cmap_bike(norm_bike(top))
-                else:
-                    agent.color = cmap_bike(norm_bike(agent.heat_accumulation))
-            elif isinstance(agent, RoadAgent):
-                if agent.heat_accumulation > top:
-                    agent.color = cmap_road(norm_road(top))
-                else:
-                    agent.color = cmap_road(norm_road(agent.heat_accumulation))
-                    # if want full heat contribution of roads, can do below line
-                    # agent.color = cmap_road(norm_road(agent.heat_contribution))
-        if max_bike and max_road:
-            print("Geometry: " + str(max_bike.geometry) + " heat: " + str(max_bike.heat_accumulation))
-            print("Geometry: " + str(max_road.geometry) + " heat: " + str(max_road.heat_accumulation))
+        # set up biker agents, one per route, or none yet when they are created as their trips set off
+        if departures is None:
+            self.biker_agents = self.create_bikers(np.arange(len(routes)))
+            bikers = self.biker_agents
+        else:
+            # biker of each trip while it is riding, None before it sets off and after it arrives
+            self.biker_agents = [None] * len(departures)
+            bikers = []
+        self.record_construction_time('biker agents')
 
+        self.space.add_agents(self.road_agents + bikers)
+        self.record_construction_time('space')
+        self.schedule.add_agents(self.road_agents + bikers)
+        self.record_construction_time('schedule')
+
+        # edge slots of the road agents, so road heat can be read for all of them in one array operation
+        self.road_slots = np.array([road.edge_slot for road in self.road_agents], dtype=np.int64)
+        self.road_contribution = self.edge_costs.road_heat_cost[self.road_slots]
+
+        # 256 entry rgba lookup tables, the same resolution matplotlib colormaps use
+        self.bike_colors = [tuple(c) for c in matplotlib.colormaps['Reds'](np.arange(COLOR_LUT_SIZE)).tolist()]
+        self.road_colors = [tuple(c) for c in matplotlib.colormaps['Blues'](np.arange(COLOR_LUT_SIZE)).tolist()]
+        # lookup table index each agent was last drawn with, -1 until first colored
+        self.biker_color_index = np.full(len(self.biker_agents), -1, dtype=np.int64)
+        self.road_color_index = np.full(len(self.road_agents), -1, dtype=np.int64)
+        # running hottest biker and road, heat only ever increases so only changed agents need checking
+        self.drawn_biker_heat = np.zeros(len(self.biker_agents))
+        self.drawn_road_heat = np.zeros(len(self.road_agents))
+        self.max_bike = None
+        self.max_road = None
 
-    def step(self):
-        """Advance the model by one step."""
-        self.steps += 1
-        self.schedule.step()
-
-        if not self.isFinished:
-            self.isFinished = True
-            # set heat contribution of road segments after bikers have moved
-            for agent in self.schedule.agents:
-                if isinstance(agent, RoadAgent):
-                    if str(agent.osmid) in self.road_map:
-                        agent.heat_accumulation += (self.road_map[str(agent.osmid)] * agent.heat_contribution)
-                else:
-                    if agent.route and len(agent.route) > agent.cur_time_step:
-                        self.isFinished = False
-                        break
         self.assign_colors()
-        self.road_map = {}
+        self.record_construction_time('colors')
+        if self.verbose:
+            print(self.construction_report())
 
-        # all paths have been run, find the hottest road segments and higlight them, the hottest normalized paths
-        if self.isFinished:
-            # 20 hottest road segements
-            final_roads = []
-            final_bikers = []
-            for agent in self.schedule.agents:
-                if isinstance(agent, RoadAgent):
-                    final_roads.append(agent)
-                else:
-                    final_bikers.append(agent)
-            sorted_roads = sorted(final_roads, key = lambda x: x.heat_accumulation, reverse=True)
-            sorted_roads = sorted_roads[0:20]
-            sorted_roads = [self.convertTuple(x.edge_id, x.heat_accumulation) for x in sorted_roads]
+    def record_construction_time(self, phase):
+        """Record the time since the last construction phase ended"""
+        now = time.perf_counter()
+        self.construction_times[phase] = now - self._construction_clock
+        self._construction_clock = now
+
+    def construction_report(self):
+        """Time spent building the model, by phase"""
+        lines = ["{}: {:.3f}s".format(phase, seconds) for phase, seconds in self.construction_times.items()]
+        lines.append("total: {:.3f}s".format(sum(self.construction_times.values())))
+        return '\n'.join(lines)
+
+    def create_bikers(self, slots):
+        '''
+        Biker agents mirroring bikers of the engine, placed where the engine has them
+        :param slots: Index of each biker in the engine's arrays and biker_heat
+        '''
+        points = shapely.points(self.engine.x[slots], self.engine.y[slots])
+        routes = self.engine.biker_routes
+        bikers = [BikerAgent(self.num_agents + i, self, point, self.space.crs, None, None, routes[slot], self.G,
+                             self.trip_count[slot], slot)
+                  for i, (point, slot) in enumerate(zip(points, slots.tolist()))]
+        self.num_agents += len(bikers)
+        return bikers
 
-            #self.highlight_max_segments(sorted_roads)
-            with open('max_road_segments.txt', 'w+') as f:
-                data_to_write = '\n'.join(sorted_roads)
+    def add_bikers(self, slots):
+        """Create the agents of bikers that have set off and add them to the map and schedule"""
+        bikers = self.create_bikers(slots)
+        for biker in bikers:
+            self.biker_agents[biker.biker_slot] = biker
+        self.space.add_agents(bikers)
+        self.schedule.add_agents(bikers)
+        # color the new bikers on the next assign_colors
+        self.biker_color_index[slots] = -1
 
-                # Write the data to the file
-                f.write(data_to_write)
+    def remove_biker(self, biker):
+        """Take a biker that has arrived out of the space, schedule and model, its heat stays in biker_heat"""
+        self.space.remove_agent(biker)
+        self.schedule.remove(biker)
+        biker.remove()
+        self.biker_agents[biker.biker_slot] = None
 
-            sorted_bikers = sorted(final_bikers, key = lambda x: x.heat_accumulation, reverse=True)
-            sorted_bikers = sorted_bikers[0:20]
-            sorted_bikers = [self.convertTuple(x.route, x.heat_accumulation) for x in sorted_bikers]
-            with open('max_biker_route.txt', 'w+') as file:
-                data_to_write = '\n'.join(sorted_bikers)
+    def assign_colors(self):
+        biker_heat = self.biker_heat
+        road_heat = self.road_heat[self.road_slots]
+        biker_index, road_index = color_indexes(biker_heat, road_heat, self.road_contribution, self.steps)
+
+        # only recolor agents whose lookup table entry changed since the last step
+        for i in np.flatnonzero(biker_index != self.biker_color_index):
+            # bikers of trips that have not set off or have arrived have no agent to color
+            if self.biker_agents[i] is not None:
+                self.biker_agents[i].color = self.bike_colors[biker_index[i]]
+        for i in np.flatnonzero(road_index != self.road_color_index):
+            self.road_agents[i].color = self.road_colors[road_index[i]]
+        self.biker_color_index = biker_index
+        self.road_color_index = road_index
 
-                # Write the data to the file
-                file.write(data_to_write)
+        changed = np.flatnonzero(biker_heat != self.drawn_biker_heat)
+        if len(changed) > 0:
+            hottest = changed[np.argmax(biker_heat[changed])]
+            if self.max_bike is None or biker_heat[hottest] > self.max_bike.heat_accumulation:
+                self.max_bike = self.biker_agents[hottest]
+        changed = np.flatnonzero(road_heat != self.drawn_road_heat)
+        if len(changed) > 0:
+            hottest = changed[np.argmax(road_heat[changed])]
+            if self.max_road is None or road_heat[hottest] > self.max_road.heat_accumulation:
+                self.max_road = self.road_agents[hottest]
+        self.drawn_biker_heat = biker_heat.copy()
+        self.drawn_road_heat = road_heat
 
+        if self.verbose and self.max_bike and self.max_road:
+            print("Geometry: " + str(self.max_bike.geometry) + " heat: " + str(self.max_bike.heat_accumulation))
+            print("Geometry: " + str(self.max_road.geometry) + " heat: " + str(self.max_road.heat_accumulation))
+
+    def step(self):
+        """Advance the model by one step."""
+        self.advance()
+
+        # all paths have been run, save the k hottest road segments and biker routes
+        if self.isFinished:
+            results = self.get_results()
+            self.write_results(results.top_roads, results.top_bikers)
             sys.exit()
             # self.highlight_max_segments(sorted_bikers[0].route)
 
@@ -214,6 +279,178 @@ class BikerModel(mesa.Model):
         #             break
         # self.highlight_max_segments(max_agent)
 
+    def advance(self):
+        """Move the bikers in the engine and mirror them onto the agents, without the end of run reporting."""
+        self.steps += 1
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.start_step(self.steps)
+        engine = self.engine
+        engine.step()
+        self.isFinished = engine.finished
+        if profiler is not None:
+            profiler.phase('engine')
+        # bikers that moved this step, a biker can ride several edges in an event driven step
+        moved = np.unique(engine.moved)
+        if self.output is not None:
+            self.output.write_step(self.steps, engine.moved_edges, engine.moved_road_heat, moved, engine.x[moved],
+                                   engine.y[moved], engine.heat[moved])
+            self.close_finished_output()
+            if profiler is not None:
+                profiler.phase('output')
+
+        if not self.headless:
+            if len(engine.departed) > 0:
+                self.add_bikers(engine.departed)
+            for slot in moved.tolist():
+                self.biker_agents[slot].step()
+            if profiler is not None:
+                profiler.phase('bikers')
+            self.assign_colors()
+            if profiler is not None:
+                profiler.phase('colors')
+            if self.departures is not None:
+                # arrived bikers leave the map once they have been drawn at their destination
+                for slot in engine.arrived.tolist():
+                    self.remove_biker(self.biker_agents[slot])
+                if profiler is not None:
+                    profiler.phase('remove')
+        if profiler is not None:
+            profiler.end_step(engine.agents_stepped, engine.edges_touched)
+        self.save_scheduled_checkpoint()
+
+    def save_scheduled_checkpoint(self):
+        """Save a checkpoint if one is due this step"""
+        if self.checkpoint is not None and self.checkpoint_every and self.steps % self.checkpoint_every == 0:
+            self.save_checkpoint(self.checkpoint)
+
+    def save_checkpoint(self, path):
+        '''
+        Save the state of the run, to pick it up again with restore_checkpoint on a model built with the same graph and
+        routes. Only what changes as the model steps is saved (the engine's arrays and clock and the random state),
+        the graph is referenced by its fingerprint.
+        :param path: File to write, replaced in one go so a run killed while saving keeps its previous checkpoint
+        '''
+        meta = {
+            'fingerprint': self.edge_costs.fingerprint,
+            'bikers': len(self.biker_heat),
+            'departures': self.departures is not None,
+            'step_seconds': self.engine.step_seconds,
+            'steps': self.steps,
+            'time': self.engine.time,
+            'next_departure': self.engine.next_departure,
+            'finished': self.isFinished,
+            'random': self.random.getstate(),
+        }
+        partial = path + '.partial'
+        with open(partial, 'wb') as f:
+            np.savez(f, meta=np.array(json.dumps(meta)), **self.engine.get_state())
+        os.replace(partial, path)
+
+    def restore_checkpoint(self, path):
+        '''
+        Resume a run from a checkpoint written by save_checkpoint, on a newly built model with the same graph, routes
+        and options. Headless and mesa runs save the same state, so either can resume the other
+        :param path: Checkpoint file
+        '''
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            arrays = {name: data[name] for name in data.files if name != 'meta'}
+        if meta['fingerprint'] != self.edge_costs.fingerprint:
+            raise ValueError("Checkpoint was saved on graph {} but the model graph is {}".format(
+                meta['fingerprint'], self.edge_costs.fingerprint))
+        if (meta['bikers'], meta['departures'], meta['step_seconds']) != (len(self.biker_heat),
+                                                                          self.departures is not None,
+                                                                          self.engine.step_seconds):
+            raise ValueError("Checkpoint was saved from a model with different routes or options")
+
+        self.steps = meta['steps']
+        self.isFinished = meta['finished']
+        version, state, gauss = meta['random']
+        self.random.setstate((version, tuple(state), gauss))
+        self.engine.set_state(arrays, meta['steps'], meta['time'], meta['next_departure'])
+        if self.headless:
+            return
+
+        if self.departures is not None:
+            # bring back the bikers that were riding
+            self.add_bikers(self.engine.active)
+        for biker in self.biker_agents:
+            if biker is not None:
+                biker.step()
+
+        # redraw every agent
+        self.biker_color_index[:] = -1
+        self.road_color_index[:] = -1
+        self.drawn_biker_heat[:] = 0
+        self.drawn_road_heat[:] = 0
+        self.max_bike = None
+        self.max_road = None
+        self.assign_colors()
+
+    def close_finished_output(self):
+        """Flush the step output once every biker is done"""
+        if self.isFinished and self.output is not None:
+            self.output.close()
+
+    def run_to_completion(self, k=None):
+        '''
+        Run until every biker has finished their route, for batch use where step() would exit the interpreter
+        :param k: Number of hottest road segments and bikers to report, defaults to the model's k
+        :return: SimulationResults with the per edge and per biker heat
+        '''
+        while not self.isFinished:
+            self.advance()
+        self.running = False
+        return self.get_results(k)
+
+    def get_results(self, k=None):
+        """Heat accumulated so far by road segment and biker, with the k hottest of each, defaults to the model's k"""
+        return self.engine.results(self.k if k is None else k, self.rank_per_exposure)
+
+    def biker_routes(self):
+        """Route of each biker slot"""
+        return self.engine.biker_routes
+
+    def hottest_roads(self, k=None, per_exposure=None):
+        '''
+        The hottest road segments so far as ((u, v, key), heat), cheap enough to call every step
+        :param k: Number of segments, defaults to the model's k
+        :param per_exposure: Rank by heat per second ridden, defaults to the model's rank_per_exposure
+        '''
+        return self.engine.hottest_roads(self.k if k is None else k,
+                                         self.rank_per_exposure if per_exposure is None else per_exposure)
+
+    def hottest_bikers(self, k=None, per_exposure=None):
+        '''
+        The hottest bikers so far as (route, heat), cheap enough to call every step
+        :param k: Number of bikers, defaults to the model's k
+        :param per_exposure: Rank by heat per second ridden, defaults to the model's rank_per_exposure
+        '''
+        return self.engine.hottest_bikers(self.k if k is None else k,
+                                          self.rank_per_exposure if per_exposure is None else per_exposure)
+
+    def write_results(self, top_roads, top_bikers):
+        '''
+        Save the hottest road segments and biker routes to the working directory
+        :param top_roads: List of (edge id, heat) for the hottest road segments
+        :param top_bikers: List of (route, heat) for the hottest bikers
+        '''
+        sorted_roads = [self.convertTuple(edge, heat) for edge, heat in top_roads]
+        #self.highlight_max_segments(sorted_roads)
+        with open('max_road_segments.txt', 'w+') as f:
+            data_to_write = '\n'.join(sorted_roads)
+
+            # Write the data to the file
+            f.write(data_to_write)
+
+        sorted_bikers = [self.convertTuple(route, heat) for route, heat in top_bikers]
+        with open('max_biker_route.txt', 'w+') as file:
+            data_to_write = '\n'.join(sorted_bikers)
+
+            # Write the data to the file
+            file.write(data_to_write)
+
     def convertTuple(self, tup, heat):
         # initialize an empty string
         strg = ''
@@ -224,6 +461,8 @@ class BikerModel(mesa.Model):
 
     # this fucntion colors the edges of the route with the highest heat accumulation (route will be pre saved)
     def assign_color_max_route(self, max_bike):
+        self.biker_color_index[:] = -1
+        self.road_color_index[:] = -1
         for agent in self.schedule.agents:
             if isinstance(agent, BikerAgent):
                 # red_val = norm_bike(agent.heat_accumulation)
@@ -237,6 +476,8 @@ class BikerModel(mesa.Model):
 
     # highlights all the edges passed in max_segments - can be used to show any set of segments; max segments is a list of edge ids
     def highlight_max_segments(self, max_segments):
+        self.biker_color_index[:] = -1
+        self.road_color_index[:] = -1
         for agent in self.schedule.agents:
             if isinstance(agent, BikerAgent):
                 agent.color = (255, 255, 255, 1)
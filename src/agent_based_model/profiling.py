@@ -0,0 +1,77 @@
+import csv
+import json
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # not available on windows, peak memory is then left out
+    resource = None
+
+
+def peak_memory_mb():
+    """Peak resident memory of the process so far in MB, None where it cannot be read"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on linux
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / (1 << 10)
+
+
+class StepProfiler:
+    """
+    Per step timings and counts for BikerModel, kept as a list of dicts in records, one per step:
+    step, the wall time in seconds of each phase of the step (e.g. bikers, roads, colors), between_steps (time since
+    the previous step ended, which is where the server renders), agents_stepped, edges_touched and peak_memory_mb.
+
+    The model only creates one when asked to profile, so an unprofiled run pays a single None check per phase.
+    """
+
+    def __init__(self):
+        self.records = []
+        self._record = None
+        self._mark = None
+        self._step_end = None
+
+    def start_step(self, step):
+        now = time.perf_counter()
+        self._record = {'step': step, 'between_steps': now - self._step_end if self._step_end is not None else 0.0}
+        self._mark = now
+
+    def phase(self, name):
+        """End the current phase of the step, timed from the start of the step or the end of the previous phase"""
+        now = time.perf_counter()
+        self._record[name] = self._record.get(name, 0.0) + now - self._mark
+        self._mark = now
+
+    def end_step(self, agents_stepped, edges_touched):
+        self._record['agents_stepped'] = int(agents_stepped)
+        self._record['edges_touched'] = int(edges_touched)
+        self._record['peak_memory_mb'] = peak_memory_mb()
+        self.records.append(self._record)
+        self._record = None
+        self._step_end = time.perf_counter()
+
+    def phases(self):
+        """Names of the timed phases, in the order they first appear"""
+        names = {}
+        for record in self.records:
+            for name in record:
+                if name not in ('step', 'agents_stepped', 'edges_touched', 'peak_memory_mb'):
+                    names[name] = None
+        return list(names)
+
+    def summary(self):
+        """Total seconds per phase over all recorded steps"""
+        return {name: sum(record.get(name, 0.0) for record in self.records) for name in self.phases()}
+
+    def to_json(self, path):
+        with open(path, 'w') as f:
+            json.dump({'summary': self.summary(), 'steps': self.records}, f, indent=1)
+
+    def to_csv(self, path):
+        columns = ['step'] + self.phases() + ['agents_stepped', 'edges_touched', 'peak_memory_mb']
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=columns, restval=0.0)
+            writer.writeheader()
+            writer.writerows(self.records)
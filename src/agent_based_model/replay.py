@@ -0,0 +1,173 @@
+import functools
+import json
+import os
+import numpy as np
+import matplotlib
+from shapely.geometry import mapping
+from graph_snapshot import road_segments
+from model import COLOR_LUT_SIZE, BikerModel, color_indexes
+
+FRAMES_PER_CHUNK = 100
+
+
+def color_table(name):
+    """rgb strings of a matplotlib colormap at lookup table resolution, as server.biker_draw formats them"""
+    colors = (matplotlib.colormaps[name](np.arange(COLOR_LUT_SIZE))[:, :3] * 255).astype(int)
+    return ["rgb({},{},{})".format(*color) for color in colors.tolist()]
+
+
+def record_replay(G, routes, path, frames_per_chunk=FRAMES_PER_CHUNK, **model_params):
+    '''
+    Run the model headlessly and save every step as a frame to replay in replay_server.py.
+
+    A frame holds only the bikers that moved and the bikers and roads whose color changed since the previous frame,
+    so most of the map is sent once. Frames are saved in compressed chunks of frames_per_chunk, each starting with
+    the full state at its first frame so a viewer can jump to any frame by applying at most one chunk of changes.
+    Road geometry is saved once as GeoJSON.
+    :param G: Osm network graph with t2 heat values on its nodes, or its GraphSnapshot
+    :param routes: RouteStore or route tuples, see routes.load_routes
+    :param path: Directory to save the replay to
+    :param model_params: Other BikerModel arguments, e.g. heat_field
+    :return: Number of frames recorded
+    '''
+    os.makedirs(path, exist_ok=True)
+    model = BikerModel(None, G, headless=True, routes=routes, **model_params)
+    engine = model.engine
+    road_slots, geometries, _ = road_segments(G, model.edge_costs)
+    road_contribution = model.edge_costs.road_heat_cost[road_slots]
+
+    features = [{'type': 'Feature', 'id': i, 'geometry': mapping(geometry), 'properties': {}}
+                for i, geometry in enumerate(geometries)]
+    with open(os.path.join(path, 'roads.geojson'), 'w') as f:
+        json.dump({'type': 'FeatureCollection', 'features': features}, f)
+
+    # state after the previous frame, frame 0 changes everything
+    x = np.full(len(engine.x), np.nan, dtype=np.float32)
+    y = np.full(len(engine.y), np.nan, dtype=np.float32)
+    biker_color = np.full(len(engine.heat), -1, dtype=np.int16)
+    road_color = np.full(len(road_slots), -1, dtype=np.int16)
+    chunk = []
+    frames = 0
+    bounds = [float(engine.x.min()), float(engine.y.min()), float(engine.x.max()), float(engine.y.max())] \
+        if len(engine.x) else None
+    while True:
+        new_x = engine.x.astype(np.float32)
+        new_y = engine.y.astype(np.float32)
+        new_biker_color, new_road_color = color_indexes(engine.heat, engine.road_heat[road_slots], road_contribution,
+                                                        model.steps)
+        if not chunk:
+            keyframe = (new_x, new_y, new_biker_color.astype(np.uint8), new_road_color.astype(np.uint8))
+        moved = np.flatnonzero((new_x != x) | (new_y != y))
+        recolored_bikers = np.flatnonzero(new_biker_color != biker_color)
+        recolored_roads = np.flatnonzero(new_road_color != road_color)
+        chunk.append((moved, new_x[moved], new_y[moved], recolored_bikers, new_biker_color[recolored_bikers],
+                      recolored_roads, new_road_color[recolored_roads]))
+        x, y, biker_color, road_color = new_x, new_y, new_biker_color, new_road_color
+        frames += 1
+
+        if len(chunk) == frames_per_chunk or model.isFinished:
+            save_chunk(os.path.join(path, chunk_name((frames - 1) // frames_per_chunk)), keyframe, chunk)
+            chunk = []
+        if model.isFinished:
+            break
+        model.advance()
+
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump({'frames': frames, 'frames_per_chunk': frames_per_chunk, 'bikers': len(engine.heat),
+                   'roads': len(road_slots), 'bounds': bounds, 'biker_colors': color_table('Reds'),
+                   'road_colors': color_table('Blues')}, f)
+    return frames
+
+
+def chunk_name(chunk):
+    return "frames_{:06d}.npz".format(chunk)
+
+
+def save_chunk(path, keyframe, frames):
+    """Save a keyframe and the changes of each frame after it, the changes in CSR form like the route store"""
+    arrays = dict(zip(('key_x', 'key_y', 'key_biker_color', 'key_road_color'), keyframe))
+    names = ('moved', 'x', 'y', 'recolored_bikers', 'biker_color', 'recolored_roads', 'road_color')
+    dtypes = (np.int32, np.float32, np.float32, np.int32, np.uint8, np.int32, np.uint8)
+    for column, (name, dtype) in enumerate(zip(names, dtypes)):
+        values = [frame[column] for frame in frames]
+        arrays[name] = np.concatenate(values).astype(dtype)
+        if name in ('moved', 'recolored_bikers', 'recolored_roads'):
+            arrays[name + '_offsets'] = np.concatenate([[0], np.cumsum([len(v) for v in values])]).astype(np.int64)
+    np.savez_compressed(path, **arrays)
+
+
+class Replay:
+    """
+    Frames saved by record_replay. frame(i) gives the changes of frame i and state(i) the full map at frame i,
+    chunks are read from disk as they are needed and the most recent ones are kept in memory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.frames = self.meta['frames']
+        self.frames_per_chunk = self.meta['frames_per_chunk']
+
+    def __len__(self):
+        return self.frames
+
+    @functools.lru_cache(maxsize=8)
+    def chunk(self, chunk):
+        with np.load(os.path.join(self.path, chunk_name(chunk))) as data:
+            return {name: data[name] for name in data.files}
+
+    def roads_geojson(self):
+        """The road geometries as a GeoJSON string, feature ids are road indexes in the frames"""
+        with open(os.path.join(self.path, 'roads.geojson')) as f:
+            return f.read()
+
+    def frame(self, i):
+        '''
+        Changes in frame i from frame i - 1
+        :return: dict of moved (biker indexes, x, y), bikers (biker indexes, color indexes) and roads (road
+                 indexes, color indexes)
+        '''
+        data = self.chunk(i // self.frames_per_chunk)
+        n = i % self.frames_per_chunk
+
+        def rows(name):
+            offsets = data[name + '_offsets']
+            return slice(offsets[n], offsets[n + 1])
+
+        moved = rows('moved')
+        bikers = rows('recolored_bikers')
+        roads = rows('recolored_roads')
+        return {
+            'moved': (data['moved'][moved], data['x'][moved], data['y'][moved]),
+            'bikers': (data['recolored_bikers'][bikers], data['biker_color'][bikers]),
+            'roads': (data['recolored_roads'][roads], data['road_color'][roads]),
+        }
+
+    def state(self, i):
+        '''
+        Full map at frame i, the chunk's keyframe with the changes of the frames since applied
+        :return: (x, y, biker color indexes, road color indexes)
+        '''
+        data = self.chunk(i // self.frames_per_chunk)
+        x = data['key_x'].copy()
+        y = data['key_y'].copy()
+        biker_color = data['key_biker_color'].copy()
+        road_color = data['key_road_color'].copy()
+        for frame in range(i - i % self.frames_per_chunk + 1, i + 1):
+            changes = self.frame(frame)
+            moved, moved_x, moved_y = changes['moved']
+            x[moved] = moved_x
+            y[moved] = moved_y
+            biker_color[changes['bikers'][0]] = changes['bikers'][1]
+            road_color[changes['roads'][0]] = changes['roads'][1]
+        return x, y, biker_color, road_color
+
+
+if __name__ == '__main__':
+    from graph_snapshot import GraphSnapshot
+    from routes import load_routes
+
+    graph_path = "/Users/emmacorbett/PycharmProjects/USE_Lab/src/agent_based_model/ny_bike_graph_heat_included_2.graphml"
+    replay_path = "/Users/emmacorbett/PycharmProjects/USE_Lab/src/agent_based_model/replay"
+    print("Recorded {} frames".format(record_replay(GraphSnapshot.load_or_build(graph_path), load_routes(), replay_path)))
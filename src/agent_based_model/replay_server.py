@@ -0,0 +1,193 @@
+import json
+import numpy as np
+import tornado.ioloop
+import tornado.web
+from replay import Replay
+
+# frames sent per request while playing, the page asks for the next batch before it runs out
+FRAME_BATCH = 50
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<title>Biker model replay</title>
+<link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css"/>
+<script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
+<style>
+body { margin: 0; font-family: sans-serif; }
+#map { position: absolute; top: 40px; bottom: 0; width: 100%; }
+#controls { height: 40px; display: flex; align-items: center; gap: 10px; padding: 0 10px; }
+#scrub { flex: 1; }
+</style>
+</head>
+<body>
+<div id="controls">
+  <button id="play">Play</button>
+  <input id="scrub" type="range" min="0" value="0">
+  <span id="step">Steps: 0</span>
+  <select id="speed">
+    <option value="1">1 fps</option><option value="5">5 fps</option><option value="10" selected>10 fps</option>
+    <option value="30">30 fps</option><option value="60">60 fps</option>
+  </select>
+</div>
+<div id="map"></div>
+<script>
+const map = L.map('map', {preferCanvas: true});
+L.tileLayer('https://tile.openstreetmap.org/{z}/{x}/{y}.png', {maxZoom: 19}).addTo(map);
+let meta, roads = {}, bikers = [], frame = 0, buffer = {}, playing = false, timer = null, fetching = false;
+
+function colorBiker(i, c) { bikers[i].setStyle({color: meta.biker_colors[c], fillColor: meta.biker_colors[c]}); }
+function colorRoad(i, c) { roads[i].setStyle({color: meta.road_colors[c]}); }
+
+function apply(changes) {
+  changes.moved.forEach(([i, x, y]) => bikers[i].setLatLng([y, x]));
+  changes.bikers.forEach(([i, c]) => colorBiker(i, c));
+  changes.roads.forEach(([i, c]) => colorRoad(i, c));
+}
+
+function show(i) {
+  frame = i;
+  document.getElementById('scrub').value = i;
+  document.getElementById('step').textContent = 'Steps: ' + i;
+}
+
+async function seek(i) {
+  const state = await (await fetch('state?frame=' + i)).json();
+  state.x.forEach((x, b) => bikers[b].setLatLng([state.y[b], x]));
+  state.biker_colors.forEach((c, b) => colorBiker(b, c));
+  state.road_colors.forEach((c, r) => colorRoad(r, c));
+  buffer = {};
+  show(i);
+}
+
+async function fill() {
+  let start = frame + 1;
+  while (buffer[start] !== undefined) start++;
+  if (fetching || start >= meta.frames || start > frame + __FRAME_BATCH__) return;
+  fetching = true;
+  const frames = await (await fetch('frames?start=' + start + '&count=__FRAME_BATCH__')).json();
+  frames.forEach((changes, n) => buffer[start + n] = changes);
+  fetching = false;
+}
+
+function tick() {
+  if (frame + 1 >= meta.frames) { pause(); return; }
+  const changes = buffer[frame + 1];
+  if (changes !== undefined) {
+    delete buffer[frame + 1];
+    apply(changes);
+    show(frame + 1);
+  }
+  fill();
+}
+
+function play() {
+  playing = true;
+  document.getElementById('play').textContent = 'Pause';
+  timer = setInterval(tick, 1000 / document.getElementById('speed').value);
+}
+
+function pause() {
+  playing = false;
+  document.getElementById('play').textContent = 'Play';
+  clearInterval(timer);
+}
+
+document.getElementById('play').onclick = () => playing ? pause() : play();
+document.getElementById('speed').onchange = () => { if (playing) { pause(); play(); } };
+document.getElementById('scrub').onchange = (e) => { pause(); seek(Number(e.target.value)); };
+
+(async () => {
+  meta = await (await fetch('meta')).json();
+  document.getElementById('scrub').max = meta.frames - 1;
+  if (meta.bounds) map.fitBounds([[meta.bounds[1], meta.bounds[0]], [meta.bounds[3], meta.bounds[2]]]);
+  // road geometry is sent once, frames only carry color changes
+  const geojson = await (await fetch('roads')).json();
+  L.geoJSON(geojson, {style: {weight: 2}, onEachFeature: (f, layer) => roads[f.id] = layer}).addTo(map);
+  for (let i = 0; i < meta.bikers; i++) {
+    bikers.push(L.circleMarker([0, 0], {radius: 3, weight: 1, fillOpacity: 1}).addTo(map));
+  }
+  await seek(0);
+})();
+</script>
+</body>
+</html>
+""".replace('__FRAME_BATCH__', str(FRAME_BATCH))
+
+
+def frame_json(changes):
+    """Changes of a frame as lists of [biker, x, y], [biker, color] and [road, color]"""
+    moved, x, y = changes['moved']
+    return {
+        'moved': [[i, round(a, 6), round(b, 6)] for i, a, b in zip(moved.tolist(), x.astype(np.float64).tolist(),
+                                                                     y.astype(np.float64).tolist())],
+        'bikers': np.column_stack(changes['bikers']).tolist(),
+        'roads': np.column_stack(changes['roads']).tolist(),
+    }
+
+
+class ReplayHandler(tornado.web.RequestHandler):
+    def initialize(self, replay):
+        self.replay = replay
+
+    def write_json(self, data):
+        self.set_header('Content-Type', 'application/json')
+        self.write(json.dumps(data))
+
+
+class PageHandler(ReplayHandler):
+    def get(self):
+        self.write(PAGE)
+
+
+class MetaHandler(ReplayHandler):
+    def get(self):
+        self.write_json(self.replay.meta)
+
+
+class RoadsHandler(ReplayHandler):
+    def get(self):
+        # never changes for a recorded run, so browsers only fetch it once
+        self.set_header('Content-Type', 'application/json')
+        self.set_header('Cache-Control', 'max-age=86400')
+        self.write(self.replay.roads_geojson())
+
+
+class FramesHandler(ReplayHandler):
+    def get(self):
+        start = int(self.get_argument('start'))
+        end = min(start + int(self.get_argument('count', str(FRAME_BATCH))), len(self.replay))
+        self.write_json([frame_json(self.replay.frame(i)) for i in range(start, end)])
+
+
+class StateHandler(ReplayHandler):
+    def get(self):
+        frame = min(max(int(self.get_argument('frame')), 0), len(self.replay) - 1)
+        x, y, biker_colors, road_colors = self.replay.state(frame)
+        self.write_json({'frame': frame, 'x': np.round(x.astype(np.float64), 6).tolist(),
+                         'y': np.round(y.astype(np.float64), 6).tolist(), 'biker_colors': biker_colors.tolist(),
+                         'road_colors': road_colors.tolist()})
+
+
+def make_app(replay_path):
+    '''
+    Tornado app serving a run recorded with replay.record_replay. Nothing is simulated per request, every viewer
+    reads the same precomputed frames, gzipped on the way out.
+    :param replay_path: Directory the replay was recorded to
+    '''
+    replay = {'replay': Replay(replay_path)}
+    return tornado.web.Application([
+        (r"/", PageHandler, replay),
+        (r"/meta", MetaHandler, replay),
+        (r"/roads", RoadsHandler, replay),
+        (r"/frames", FramesHandler, replay),
+        (r"/state", StateHandler, replay),
+    ], compress_response=True)
+
+
+if __name__ == '__main__':
+    replay_path = "/Users/emmacorbett/PycharmProjects/USE_Lab/src/agent_based_model/replay"
+    port = 8522
+    make_app(replay_path).listen(port)
+    print("Serving replay on http://127.0.0.1:{}".format(port))
+    tornado.ioloop.IOLoop.current().start()
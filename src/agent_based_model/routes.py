@@ -0,0 +1,195 @@
+import json
+import os
+import warnings
+import numpy as np
+import pandas as pd
+
+# output of generate_shortest_paths.py
+ROUTE_TABLE_PATH = "/Users/emmacorbett/PycharmProjects/USE_Lab/src/agent_based_model/top_journey_counts.csv"
+ROUTE_STORE_PATH = "/Users/emmacorbett/PycharmProjects/USE_Lab/src/agent_based_model/top_journey_routes"
+DEPARTURES_PATH = "/Users/emmacorbett/PycharmProjects/USE_Lab/src/agent_based_model/top_journey_departures"
+
+
+class RouteStore:
+    """
+    Routes of every od pair in CSR form: the osm node ids of all routes concatenated in nodes, with route i being
+    nodes[offsets[i]:offsets[i + 1]], plus an origin / destination / trip_count side table and the fingerprint of the
+    graph the routes were computed on (see EdgeCostTable.fingerprint).
+
+    Saved as a directory of .npy files that open memory mapped, so loading is independent of the number of routes
+    and a Python list is only made for a route when it is indexed. Iterating gives the same
+    (origin_osm_node, route, trip_count) tuples the model has always used.
+    """
+
+    def __init__(self, nodes, offsets, origin, destination, trip_count, fingerprint=None):
+        self.nodes = nodes
+        self.offsets = offsets
+        self.origin = origin
+        self.destination = destination
+        self.trip_count = trip_count
+        self.fingerprint = fingerprint
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        """Route i as a list of osm node ids"""
+        return self.nodes[self.offsets[i]:self.offsets[i + 1]].tolist()
+
+    def __iter__(self):
+        for i in range(len(self)):
+            route = self[i]
+            yield route[0], route, self.trip_count[i]
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    @classmethod
+    def from_routes(cls, routes, origin=None, destination=None, fingerprint=None):
+        '''
+        Build a store from route tuples
+        :param routes: List of (origin_osm_node, route, trip_count) tuples
+        :param origin: Optional origin station id of each route
+        :param destination: Optional destination station id of each route
+        :param fingerprint: Fingerprint of the graph the routes are on
+        '''
+        lengths = np.array([len(route) for _, route, _ in routes], dtype=np.int64)
+        offsets = np.zeros(len(routes) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        nodes = np.fromiter((node for _, route, _ in routes for node in route), dtype=np.int64, count=offsets[-1])
+        trip_count = np.array([trip_count for _, _, trip_count in routes], dtype=np.float64)
+        origin = np.array(origin if origin is not None else [''] * len(routes), dtype=str)
+        destination = np.array(destination if destination is not None else [''] * len(routes), dtype=str)
+        return cls(nodes, offsets, origin, destination, trip_count, fingerprint)
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for name in ('nodes', 'offsets', 'origin', 'destination', 'trip_count'):
+            np.save(os.path.join(path, name + '.npy'), getattr(self, name))
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({'fingerprint': self.fingerprint, 'routes': len(self)}, f)
+
+    @classmethod
+    def open(cls, path):
+        """Memory map a store written by save"""
+        arrays = [np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+                  for name in ('nodes', 'offsets', 'origin', 'destination', 'trip_count')]
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        return cls(*arrays, fingerprint=meta['fingerprint'])
+
+    def check_graph(self, edge_costs):
+        """Warn if the routes were computed on a different graph than the one being simulated"""
+        if self.fingerprint and self.fingerprint != edge_costs.fingerprint:
+            warnings.warn("Routes were computed on graph {} but the model graph is {}".format(
+                self.fingerprint, edge_costs.fingerprint))
+
+
+class Departures:
+    """
+    Every citibike trip as the route it rides and the time it sets off, sorted by start time, so the model can
+    create each biker when its trip starts instead of one biker per route up front. route[i] is the index of the
+    trip's od pair in the RouteStore the table was built against and start[i] its started_at in seconds since the
+    epoch.
+    """
+
+    def __init__(self, route, start):
+        self.route = route
+        self.start = start
+
+    def __len__(self):
+        return len(self.route)
+
+    @classmethod
+    def from_trips(cls, trips, routes):
+        '''
+        Match trips to the routes of their od pairs, dropping trips whose od pair has no route
+        :param trips: DataFrame of citibike trips with start_station_id, end_station_id and started_at columns
+        :param routes: RouteStore with the origin and destination station id of each route
+        '''
+        od_pairs = pd.MultiIndex.from_arrays([np.asarray(routes.origin).astype(str),
+                                              np.asarray(routes.destination).astype(str)])
+        route = od_pairs.get_indexer(pd.MultiIndex.from_arrays([trips['start_station_id'].astype(str),
+                                                                 trips['end_station_id'].astype(str)]))
+        start = pd.to_datetime(trips['started_at']).to_numpy().astype('datetime64[s]').astype(np.int64)
+        matched = route >= 0
+        order = np.argsort(start[matched], kind='stable')
+        return cls(route[matched][order].astype(np.int64), start[matched][order])
+
+    def seconds_since(self, start_time):
+        """Start of every trip in seconds after start_time, anything np.datetime64 accepts"""
+        return self.start - np.datetime64(start_time, 's').astype(np.int64)
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for name in ('route', 'start'):
+            np.save(os.path.join(path, name + '.npy'), getattr(self, name))
+
+    @classmethod
+    def open(cls, path):
+        """Memory map a table written by save"""
+        return cls(*[np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in ('route', 'start')])
+
+
+class TripRoutes:
+    """The route of each trip in a Departures table, looked up in the route store rather than copied per trip"""
+
+    def __init__(self, routes, departures):
+        self.routes = routes
+        self.departures = departures
+
+    def __len__(self):
+        return len(self.departures)
+
+    def __getitem__(self, i):
+        return self.routes[self.departures.route[i]]
+
+
+def as_route_store(routes):
+    """Route tuples as a RouteStore, stores are returned as they are"""
+    return routes if isinstance(routes, RouteStore) else RouteStore.from_routes(routes)
+
+
+def load_routes(store_path=ROUTE_STORE_PATH, csv_path=ROUTE_TABLE_PATH):
+    '''
+    Open the route store written by generate_shortest_paths.py, falling back on parsing the route csv
+    :return: RouteStore
+    '''
+    if os.path.exists(os.path.join(store_path, 'meta.json')):
+        return RouteStore.open(store_path)
+    return read_routes(csv_path)
+
+
+def read_routes(path=ROUTE_TABLE_PATH):
+    '''
+    Read the od pairs and shortest path routes saved by generate_shortest_paths.py
+    :param path: Path of the route csv file
+    :return: RouteStore with one route per journey with a usable route
+    '''
+    return routes_from_frame(pd.read_csv(path, dtype={'origin': str, 'destination': str}))
+
+
+def routes_from_frame(bikers, fingerprint=None):
+    '''
+    Convert a route table to the route store the model runs on
+    :param bikers: DataFrame with the columns of top_journey_counts.csv, shortest_path may be a list or its string
+    :param fingerprint: Fingerprint of the graph the routes were computed on
+    :return: RouteStore with one route per journey with a usable route
+    '''
+    routes = []
+    origin = []
+    destination = []
+    for _, row in bikers.iterrows():
+        route = row['shortest_path'] if 'shortest_path' in row else None
+        if isinstance(route, str) and route:
+            route = [int(x) for x in route.strip('][').split(', ')]
+        if route is None or isinstance(route, float):
+            continue
+
+        # drop journeys that start and end at same location, since we cannot assume their path
+        if len(route) > 1:
+            routes.append((route[0], list(route), row['trip_count']))
+            origin.append(row['origin'] if 'origin' in row else '')
+            destination.append(row['destination'] if 'destination' in row else '')
+    return RouteStore.from_routes(routes, origin, destination, fingerprint)
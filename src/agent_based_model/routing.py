@@ -0,0 +1,138 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import scipy.sparse
+from scipy.sparse.csgraph import dijkstra
+
+
+def edge_weights(snapshot, weight):
+    '''
+    Weight of every edge slot of a snapshot
+    :param snapshot: GraphSnapshot of the heat graph
+    :param weight: 'travel_time', 'length', 'heat' (travel time * t2 at the head node, the heat a biker picks up) or
+                   an array with a weight per edge slot
+    '''
+    if weight == 'travel_time':
+        return snapshot.edge_travel_times()
+    if weight == 'length':
+        return np.asarray(snapshot.length, dtype=np.float64)
+    if weight == 'heat':
+        return snapshot.edge_costs().heat_cost
+    if isinstance(weight, str):
+        raise ValueError("Unknown edge weight {}".format(weight))
+    return np.asarray(weight, dtype=np.float64)
+
+
+class RoutingGraph:
+    """
+    Adjacency matrix of the heat graph for one edge weight, in the sparse form scipy's shortest path searches take.
+    Like ox.shortest_path on the MultiDiGraph, only the cheapest of parallel edges between two nodes is kept. Nodes
+    are the positions of the snapshot's node arrays and node_ids maps them back to osm node ids.
+    """
+
+    def __init__(self, node_ids, matrix):
+        self.node_ids = node_ids
+        self.matrix = matrix
+        self.node_order = np.argsort(node_ids)
+
+    @classmethod
+    def from_snapshot(cls, snapshot, weight='travel_time'):
+        '''
+        :param snapshot: GraphSnapshot of the heat graph
+        :param weight: Edge weight to route on, see edge_weights
+        '''
+        u = snapshot.node_index(snapshot.u)
+        v = snapshot.node_index(snapshot.v)
+        w = edge_weights(snapshot, weight)
+        keep = (u != v) & np.isfinite(w)
+        u, v, w = u[keep], v[keep], w[keep]
+        # cheapest edge first for every node pair, then drop the rest so the matrix doesn't sum them
+        order = np.lexsort((w, v, u))
+        u, v, w = u[order], v[order], w[order]
+        first = np.ones(len(u), dtype=bool)
+        first[1:] = (u[1:] != u[:-1]) | (v[1:] != v[:-1])
+        n = snapshot.number_of_nodes()
+        matrix = scipy.sparse.csr_matrix((w[first], (u[first], v[first])), shape=(n, n))
+        return cls(np.asarray(snapshot.node_ids), matrix)
+
+    def node_index(self, node_ids):
+        """Position of each osm node id in the graph"""
+        return self.node_order[np.searchsorted(self.node_ids, node_ids, sorter=self.node_order)]
+
+    def paths_from(self, origin, destinations):
+        '''
+        Shortest paths from one origin to many destinations, from a single search and its predecessor tree
+        :param origin: Node position of the origin
+        :param destinations: Node positions of the destinations
+        :return: List of routes as lists of osm node ids, None for destinations that can't be reached
+        '''
+        distances, predecessors = dijkstra(self.matrix, indices=origin, return_predecessors=True)
+        return [self.node_ids[tree_path(predecessors, origin, destination)].tolist()
+                if np.isfinite(distances[destination]) else None for destination in destinations]
+
+
+def tree_path(predecessors, origin, destination):
+    """Node positions from origin to destination in the predecessor tree of a search from origin"""
+    path = [destination]
+    while path[-1] != origin:
+        path.append(predecessors[path[-1]])
+    return path[::-1]
+
+
+# router of a worker process, sent once when the worker starts rather than with every batch of origins
+_worker_router = None
+
+
+def _init_worker(router):
+    global _worker_router
+    _worker_router = router
+
+
+def _route_origins(batch):
+    return [_worker_router.paths_from(origin, destinations) for origin, destinations in batch]
+
+
+def routes_by_origin(router, origins, destinations, processes=None, origins_per_task=16):
+    '''
+    Group od pairs by origin node and call router.paths_from once per origin with all of its destinations, spreading
+    the origins over a pool of worker processes. Results are yielded per origin as they come back, so callers can
+    write them out without holding every route in memory.
+    :param router: Object with node_index and paths_from(origin, destinations) like RoutingGraph, sent to each worker
+    :param origins: Origin osm node id of each pair
+    :param destinations: Destination osm node id of each pair
+    :param processes: Number of worker processes, defaults to the number of cpus, 1 routes in this process
+    :param origins_per_task: Origins sent to a worker at a time
+    :return: Generator of (pair indexes, paths_from result) for each distinct origin
+    '''
+    origin_index = router.node_index(np.asarray(origins, dtype=np.int64))
+    destination_index = router.node_index(np.asarray(destinations, dtype=np.int64))
+    if len(origin_index) == 0:
+        return
+    order = np.argsort(origin_index, kind='stable')
+    unique_origins, starts = np.unique(origin_index[order], return_index=True)
+    pairs = np.split(order, starts[1:])
+    tasks = [(origin, destination_index[pair]) for origin, pair in zip(unique_origins.tolist(), pairs)]
+    batches = [tasks[i:i + origins_per_task] for i in range(0, len(tasks), origins_per_task)]
+    pair_batches = [pairs[i:i + origins_per_task] for i in range(0, len(pairs), origins_per_task)]
+
+    processes = processes or os.cpu_count()
+    if processes == 1 or len(batches) <= 1:
+        for pair, (origin, destination_positions) in zip(pairs, tasks):
+            yield pair, router.paths_from(origin, destination_positions)
+    else:
+        with ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(router,)) as pool:
+            for batch_pairs, results in zip(pair_batches, pool.map(_route_origins, batches)):
+                yield from zip(batch_pairs, results)
+
+
+def shortest_paths(graph, origins, destinations, processes=None, origins_per_task=16):
+    '''
+    Shortest path of every od pair, with one search per distinct origin, see routes_by_origin
+    :param graph: RoutingGraph to route on
+    :return: List of routes as lists of osm node ids in the order of the pairs, None for pairs with no path
+    '''
+    routes = [None] * len(origins)
+    for pair, origin_routes in routes_by_origin(graph, origins, destinations, processes, origins_per_task):
+        for i, route in zip(pair.tolist(), origin_routes):
+            routes[i] = route
+    return routes
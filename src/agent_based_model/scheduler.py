@@ -4,10 +4,10 @@ from mesa.model import Model
 import contextlib
 import copy
 import operator
-import weakref
 from collections import defaultdict
 from collections.abc import Callable, Iterable, Iterator, MutableSet, Sequence
 from random import Random
+from types import MappingProxyType
 from typing import Any
 from agents import BikerAgent
 
@@ -32,10 +32,10 @@ class AgentSet(MutableSet, Sequence):
         add, discard, remove, __getstate__, __setstate__, random
 
     Note:
-        The AgentSet maintains weak references to agents, allowing for efficient management of agent lifecycles
-        without preventing garbage collection. It is associated with a specific model instance, enabling
-        interactions with the model's environment and other agents.The implementation uses a WeakKeyDictionary to store agents,
-        which means that agents not referenced elsewhere in the program may be automatically removed from the AgentSet.
+        Unlike the mesa AgentSet this keeps strong references to its agents in a plain list, with a dict from agent
+        to its slot in the list. Indexing is O(1), iteration needs no weakref dereferencing, and removal is O(1) by
+        moving the last agent into the removed agent's slot, so removing agents does not preserve insertion order.
+        Agents stay in the set until they are removed.
     """
 
     agentset_experimental_warning_given = False
@@ -50,7 +50,7 @@ class AgentSet(MutableSet, Sequence):
         """
 
         self.model = model
-        self._agents = weakref.WeakKeyDictionary({agent: None for agent in agents})
+        self._update(agents)
 
     def __len__(self) -> int:
         """Return the number of agents in the AgentSet."""
@@ -58,11 +58,11 @@ class AgentSet(MutableSet, Sequence):
 
     def __iter__(self) -> Iterator[Agent]:
         """Provide an iterator over the agents in the AgentSet."""
-        return self._agents.keys()
+        return iter(self._agents)
 
     def __contains__(self, agent: Agent) -> bool:
         """Check if an agent is in the AgentSet. Can be used like `agent in agentset`."""
-        return agent in self._agents
+        return agent in self._slots
 
     def select(
         self,
@@ -101,7 +101,7 @@ class AgentSet(MutableSet, Sequence):
 
         agents = agent_generator(filter_func, agent_type, n)
 
-        return AgentSet(agents, self.model) if not inplace else self._update(agents)
+        return AgentSet(agents, self.model) if not inplace else self._update(list(agents))
 
     def shuffle(self, inplace: bool = False) -> AgentSet:
         """
@@ -117,16 +117,10 @@ class AgentSet(MutableSet, Sequence):
             Using inplace = True is more performant
 
         """
-        weakrefs = list(self._agents.keyrefs())
-        self.random.shuffle(weakrefs)
+        agents = list(self._agents)
+        self.random.shuffle(agents)
 
-        if inplace:
-            self._agents.data = {entry: None for entry in weakrefs}
-            return self
-        else:
-            return AgentSet(
-                (agent for ref in weakrefs if (agent := ref()) is not None), self.model
-            )
+        return self._update(agents) if inplace else AgentSet(agents, self.model)
 
     def sort(
         self,
@@ -148,7 +142,7 @@ class AgentSet(MutableSet, Sequence):
         if isinstance(key, str):
             key = operator.attrgetter(key)
 
-        sorted_agents = sorted(self._agents.keys(), key=key, reverse=not ascending)
+        sorted_agents = sorted(self._agents, key=key, reverse=not ascending)
 
         return (
             AgentSet(sorted_agents, self.model)
@@ -161,11 +155,16 @@ class AgentSet(MutableSet, Sequence):
         This is a private method primarily used internally by other methods like select, shuffle, and sort.
         """
 
-        self._agents = weakref.WeakKeyDictionary({agent: None for agent in agents})
+        self._agents = []
+        self._slots = {}
+        for agent in agents:
+            if agent not in self._slots:
+                self._slots[agent] = len(self._agents)
+                self._agents.append(agent)
         return self
 
     def do(
-        self, method_name: str, *args, return_results: bool = False, **kwargs
+        self, method_name: str, *args, return_results: bool = False, agent_slice: slice | None = None, **kwargs
     ) -> AgentSet | list[Any]:
         """
         Invoke a method on each agent in the AgentSet.
@@ -173,18 +172,16 @@ class AgentSet(MutableSet, Sequence):
         Args:
             method_name (str): The name of the method to call on each agent.
             return_results (bool, optional): If True, returns the results of the method calls; otherwise, returns the AgentSet itself. Defaults to False, so you can chain method calls.
+            agent_slice (slice, optional): Only call the method on the agents in this contiguous range of slots. Defaults to None, meaning all agents.
             *args: Variable length argument list passed to the method being called.
             **kwargs: Arbitrary keyword arguments passed to the method being called.
 
         Returns:
             AgentSet | list[Any]: The results of the method calls if return_results is True, otherwise the AgentSet itself.
         """
-        # we iterate over the actual weakref keys and check if weakref is alive before calling the method
-        res = [
-            getattr(agent, method_name)(*args, **kwargs)
-            for agentref in self._agents.keyrefs()
-            if (agent := agentref()) is not None
-        ]
+        # slicing copies the list, so agents can be added or removed while the method runs
+        agents = self._agents[agent_slice] if agent_slice is not None else self._agents[:]
+        res = [getattr(agent, method_name)(*args, **kwargs) for agent in agents]
 
         return res if return_results else self
 
@@ -222,7 +219,7 @@ class AgentSet(MutableSet, Sequence):
         Returns:
             Agent | list[Agent]: The selected agent or list of agents based on the index or slice provided.
         """
-        return list(self._agents.keys())[item]
+        return self._agents[item]
 
     def add(self, agent: Agent):
         """
@@ -234,7 +231,9 @@ class AgentSet(MutableSet, Sequence):
         Note:
             This method is an implementation of the abstract method from MutableSet.
         """
-        self._agents[agent] = None
+        if agent not in self._slots:
+            self._slots[agent] = len(self._agents)
+            self._agents.append(agent)
 
     def discard(self, agent: Agent):
         """
@@ -249,13 +248,14 @@ class AgentSet(MutableSet, Sequence):
             This method is an implementation of the abstract method from MutableSet.
         """
         with contextlib.suppress(KeyError):
-            del self._agents[agent]
+            self.remove(agent)
 
     def remove(self, agent: Agent):
         """
         Remove an agent from the AgentSet.
 
-        This method raises an error if the agent is not present.
+        This method raises an error if the agent is not present. The last agent in the set takes the removed
+        agent's slot.
 
         Args:
             agent (Agent): The agent to remove from the set.
@@ -263,7 +263,11 @@ class AgentSet(MutableSet, Sequence):
         Note:
             This method is an implementation of the abstract method from MutableSet.
         """
-        del self._agents[agent]
+        slot = self._slots.pop(agent)
+        last = self._agents.pop()
+        if last is not agent:
+            self._agents[slot] = last
+            self._slots[last] = slot
 
     def __getstate__(self):
         """
@@ -272,7 +276,7 @@ class AgentSet(MutableSet, Sequence):
         Returns:
             dict: A dictionary representing the state of the AgentSet.
         """
-        return {"agents": list(self._agents.keys()), "model": self.model}
+        return {"agents": list(self._agents), "model": self.model}
 
     def __setstate__(self, state):
         """
@@ -311,7 +315,7 @@ class CustomScheduler(mesa.time.BaseScheduler):
         - access via `your_model.scheduler.agents_by_type[your_type_class]`
 
         Attributes:
-            - agents_by_type (defaultdict): A dictionary mapping agent types to dictionaries of agents.
+            - agents_by_type (MappingProxyType): A read only mapping of agent types to the AgentSet of their agents.
 
         Methods:
             - step: Executes the step of each agent type in a random order.
@@ -321,18 +325,8 @@ class CustomScheduler(mesa.time.BaseScheduler):
 
     @property
     def agents_by_type(self):
-        # warnings.warn(
-        #     "Because of the shift to using AgentSet, in the future this attribute will return a dict with"
-        #     "type as key as AgentSet as value. Future behavior is available via RandomActivationByType._agents_by_type",
-        #     DeprecationWarning,
-        #     stacklevel=2,
-        # )
-
-        agentsbytype = defaultdict(dict)
-        for k, v in self._agents_by_type.items():
-            agentsbytype[k] = {agent.unique_id: agent for agent in v}
-
-        return agentsbytype
+        """Read only view of the AgentSet of each agent type, nothing is copied"""
+        return MappingProxyType(self._agents_by_type)
 
     def __init__(self, model: Model, agents: Iterable[Agent] | None = None) -> None:
         super().__init__(model)
@@ -343,15 +337,24 @@ class CustomScheduler(mesa.time.BaseScheduler):
             agents (Iterable[Agent], None, optional): An iterable of agents who are controlled by the schedule
         """
 
+        # keep the schedule's own agents in the array backed AgentSet as well, mesa's is weakref based
+        self._agents = AgentSet([], self.model)
+        if agents is not None:
+            for agent in agents:
+                self._agents.add(agent)
+
         # can't be a defaultdict because we need to pass model to AgentSet
         self._agents_by_type: [type, AgentSet] = {}
 
         if agents is not None:
             for agent in agents:
-                try:
-                    self._agents_by_type[type(agent)].add(agent)
-                except KeyError:
-                    self._agents_by_type[type(agent)] = AgentSet([agent], self.model)
+                self._add_by_type(agent)
+
+    def _add_by_type(self, agent: Agent) -> None:
+        try:
+            self._agents_by_type[type(agent)].add(agent)
+        except KeyError:
+            self._agents_by_type[type(agent)] = AgentSet([agent], self.model)
 
     def add(self, agent: Agent) -> None:
         """
@@ -361,11 +364,26 @@ class CustomScheduler(mesa.time.BaseScheduler):
             agent: An Agent to be added to the schedule.
         """
         super().add(agent)
+        self._add_by_type(agent)
 
-        try:
-            self._agents_by_type[type(agent)].add(agent)
-        except KeyError:
-            self._agents_by_type[type(agent)] = AgentSet([agent], self.model)
+    def add_agents(self, agents: Iterable[Agent]) -> None:
+        """
+        Add a batch of agents to the schedule, creating the AgentSet of each new agent type in one go
+
+        Args:
+            agents: Agents to be added to the schedule.
+        """
+        by_type = defaultdict(list)
+        for agent in agents:
+            super().add(agent)
+            by_type[type(agent)].append(agent)
+
+        for agent_type, typed_agents in by_type.items():
+            if agent_type in self._agents_by_type:
+                for agent in typed_agents:
+                    self._agents_by_type[agent_type].add(agent)
+            else:
+                self._agents_by_type[agent_type] = AgentSet(typed_agents, self.model)
 
     def remove(self, agent: Agent) -> None:
         """
@@ -398,17 +416,19 @@ class CustomScheduler(mesa.time.BaseScheduler):
 
     def step_type(self, agenttype: type[Agent]) -> None:
         """
-        Shuffle order and run all agents of a given type.
+        Run all agents of a given type.
         This method is equivalent to the NetLogo 'ask [breed]...'.
 
         Args:
             agenttype: Class object of the type to run.
         """
-        agents = self._agents_by_type[agenttype]
-        agents.do("step")
+        agents = self._agents_by_type.get(agenttype)
+        if agents is not None:
+            agents.do("step")
 
     def get_type_count(self, agenttype: type[Agent]) -> int:
         """
         Returns the current number of agents of certain type in the queue.
         """
-        return len(self._agents_by_type[agenttype])
\ No newline at end of file
+        agents = self._agents_by_type.get(agenttype)
+        return len(agents) if agents is not None else 0
@@ -2,7 +2,7 @@ import mesa
 import mesa_geo as mg
 from agents import BikerAgent, RoadAgent
 from model import BikerModel
-import osmnx as ox
+from graph_snapshot import GraphSnapshot
 
 
 class BikerText(mesa.visualization.TextElement):
@@ -17,7 +17,9 @@ class BikerText(mesa.visualization.TextElement):
         return "Steps: " + str(model.steps)
 
 
-G = ox.load_graphml(filepath="/Users/emmacorbett/PycharmProjects/USE_Lab/src/agent_based_model/ny_bike_graph_heat_included_2.graphml")
+graph_path = "/Users/emmacorbett/PycharmProjects/USE_Lab/src/agent_based_model/ny_bike_graph_heat_included_2.graphml"
+# memory mapped snapshot of the graph, built from the graphml on the first launch - see graph_snapshot.py
+G = GraphSnapshot.load_or_build(graph_path)
 model_params = {
     "dir_name": "/Users/emmacorbett/PycharmProjects/USE_Lab/data/Citibike/5_May_2024",
     "G": G
@@ -46,6 +48,7 @@ def biker_draw(agent):
 biker_text = BikerText()
 map_element = mg.visualization.MapModule(biker_draw)
 
+# runs the model live in the request loop, to watch a precomputed run instead see replay.py and replay_server.py
 server = mesa.visualization.ModularServer(
     BikerModel,
     [map_element, biker_text],
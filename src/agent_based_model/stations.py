@@ -0,0 +1,73 @@
+import os
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import BallTree
+from graph_snapshot import node_coordinates
+
+# station -> osm node tables, one per graph fingerprint
+STATION_TABLE_DIR = "/Users/emmacorbett/PycharmProjects/USE_Lab/src/agent_based_model/station_nodes"
+
+
+def station_table_path(fingerprint, directory=STATION_TABLE_DIR):
+    """Path of the station table for the graph with the given fingerprint, see EdgeCostTable.fingerprint"""
+    return os.path.join(directory, "station_nodes_{}.csv".format(fingerprint))
+
+
+def unique_stations(trips):
+    '''
+    Coordinates of every station in a citibike trip table, taken from the last trip to start or end there
+    :param trips: DataFrame with the start/end station id, lat and lng columns of the raw citibike csv files
+    :return: DataFrame of lat and lng indexed by station id as a str
+    '''
+    n = len(trips)
+    stations = pd.DataFrame({
+        'station_id': np.concatenate([trips['start_station_id'].to_numpy(), trips['end_station_id'].to_numpy()]),
+        'lat': np.concatenate([trips['start_lat'].to_numpy(), trips['end_lat'].to_numpy()]),
+        'lng': np.concatenate([trips['start_lng'].to_numpy(), trips['end_lng'].to_numpy()]),
+        # each trip's start comes before its end
+        'order': np.concatenate([np.arange(n) * 2, np.arange(n) * 2 + 1]),
+    })
+    stations = stations[stations['station_id'].notna()].sort_values('order')
+    stations['station_id'] = stations['station_id'].astype(str)
+    return stations.drop_duplicates('station_id', keep='last').set_index('station_id')[['lat', 'lng']]
+
+
+def snap_stations(G, stations):
+    '''
+    Nearest graph node of each station, in one batched query. Same haversine ball tree search as
+    ox.distance.nearest_nodes on an unprojected graph, but over the node coordinate arrays so a snapshot never has
+    to be turned back into a NetworkX graph
+    :param G: Osm network graph or its GraphSnapshot
+    :param stations: DataFrame of lat and lng, see unique_stations
+    :return: Series of osm node ids with the index of stations
+    '''
+    node_ids, x, y = node_coordinates(G)
+    tree = BallTree(np.deg2rad(np.column_stack([y, x])), metric='haversine')
+    _, nearest = tree.query(np.deg2rad(np.column_stack([stations['lat'].to_numpy(dtype=np.float64),
+                                                        stations['lng'].to_numpy(dtype=np.float64)])), k=1)
+    return pd.Series(node_ids[nearest[:, 0]], index=stations.index, name='node')
+
+
+def station_nodes(G, trips, fingerprint, directory=STATION_TABLE_DIR):
+    '''
+    Graph node of every station in a trip table. Stations are snapped once per graph and saved, so later months only
+    snap stations that were not in the table yet
+    :param G: Osm network graph or its GraphSnapshot
+    :param trips: DataFrame of citibike trips, see unique_stations
+    :param fingerprint: Fingerprint of G, the table is saved per graph
+    :param directory: Directory of the saved tables
+    :return: Series of osm node ids indexed by station id as a str
+    '''
+    path = station_table_path(fingerprint, directory)
+    if os.path.exists(path):
+        table = pd.read_csv(path, dtype={'station_id': str}).set_index('station_id')
+    else:
+        table = pd.DataFrame({'lat': [], 'lng': [], 'node': []}, index=pd.Index([], name='station_id', dtype=str))
+
+    stations = unique_stations(trips)
+    missing = stations[~stations.index.isin(table.index)]
+    if len(missing) > 0:
+        table = pd.concat([table, missing.assign(node=snap_stations(G, missing))])
+        os.makedirs(directory, exist_ok=True)
+        table.to_csv(path, index_label='station_id')
+    return table['node'].astype(np.int64)
@@ -0,0 +1,131 @@
+import json
+import os
+import numpy as np
+
+# every column is a flat binary file of one dtype, appended to as steps are written and memory mapped to read
+STEP_COLUMNS = {'step': np.int64, 'edge_end': np.int64, 'biker_end': np.int64}
+EDGE_COLUMNS = {'edge_slot': np.int64, 'edge_heat': np.float64}
+BIKER_COLUMNS = {'biker': np.int64, 'biker_x': np.float64, 'biker_y': np.float64, 'biker_heat': np.float64}
+COLUMNS = {**STEP_COLUMNS, **EDGE_COLUMNS, **BIKER_COLUMNS}
+
+
+class StepWriter:
+    """
+    Writes what changed at every step of a run: the road heat added to each edge, and the position and total heat of
+    each biker that moved. Like the route store this is CSR, the edge and biker rows of all steps are appended to
+    one file per column and edge_end / biker_end give where each step's rows end.
+
+    Steps are buffered in memory and appended to the files once buffer_rows rows have built up, so the simulation
+    only waits on disk every so often. meta.json is rewritten on every flush, so a run that dies can still be read up
+    to its last flush.
+    """
+
+    def __init__(self, path, edges, bikers, buffer_rows=1 << 20):
+        '''
+        :param path: Directory to write to, created if missing and overwritten if it exists
+        :param edges: Number of edge slots in the model
+        :param bikers: Number of biker slots in the model
+        :param buffer_rows: Edge and biker rows to buffer before appending them to disk
+        '''
+        self.path = path
+        self.edges = edges
+        self.bikers = bikers
+        self.buffer_rows = buffer_rows
+        os.makedirs(path, exist_ok=True)
+        for name in COLUMNS:
+            open(os.path.join(path, name + '.bin'), 'wb').close()
+        self.steps = 0
+        self.edge_rows = 0
+        self.biker_rows = 0
+        self._buffer = {name: [] for name in COLUMNS}
+        self._buffered = 0
+        self._write_meta()
+
+    def write_step(self, step, edge_slots, edge_heat, bikers, x, y, biker_heat):
+        '''
+        Add a step to the output
+        :param step: Model step number
+        :param edge_slots: Edge slots traversed in the step, may repeat
+        :param edge_heat: Road heat added by each traversal
+        :param bikers: Slots of the bikers that moved
+        :param x: New x coordinate of each of those bikers
+        :param y: New y coordinate of each of those bikers
+        :param biker_heat: Total heat of each of those bikers
+        '''
+        # one row per edge, with the heat of all its traversals this step
+        edge_slots, inverse = np.unique(np.asarray(edge_slots, dtype=np.int64), return_inverse=True)
+        edge_heat = np.bincount(inverse, weights=edge_heat, minlength=len(edge_slots))
+        self.edge_rows += len(edge_slots)
+        self.biker_rows += len(bikers)
+
+        columns = {
+            'step': [step], 'edge_end': [self.edge_rows], 'biker_end': [self.biker_rows],
+            'edge_slot': edge_slots, 'edge_heat': edge_heat,
+            'biker': bikers, 'biker_x': x, 'biker_y': y, 'biker_heat': biker_heat,
+        }
+        for name, values in columns.items():
+            self._buffer[name].append(np.asarray(values, dtype=COLUMNS[name]))
+        self.steps += 1
+        self._buffered += len(edge_slots) + len(bikers)
+        if self._buffered >= self.buffer_rows:
+            self.flush()
+
+    def flush(self):
+        """Append the buffered steps to the column files"""
+        for name, chunks in self._buffer.items():
+            if chunks:
+                with open(os.path.join(self.path, name + '.bin'), 'ab') as f:
+                    np.concatenate(chunks).tofile(f)
+        self._buffer = {name: [] for name in COLUMNS}
+        self._buffered = 0
+        self._write_meta()
+
+    def close(self):
+        self.flush()
+
+    def _write_meta(self):
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump({'steps': self.steps - len(self._buffer['step']), 'edges': self.edges, 'bikers': self.bikers,
+                       'columns': {name: np.dtype(dtype).str for name, dtype in COLUMNS.items()}}, f)
+
+
+class StepOutput:
+    """
+    Memory mapped reader for the output of a StepWriter. Indexing is by position in the output, steps[i] is the
+    model step number it was written at.
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        self.edges = meta['edges']
+        self.bikers = meta['bikers']
+        steps = meta['steps']
+        for name, dtype in meta['columns'].items():
+            column = np.memmap(os.path.join(path, name + '.bin'), dtype=dtype, mode='r') \
+                if os.path.getsize(os.path.join(path, name + '.bin')) else np.zeros(0, dtype=dtype)
+            setattr(self, name, column[:steps] if name in STEP_COLUMNS else column)
+        self.edge_offsets = np.concatenate([[0], self.edge_end]).astype(np.int64)
+        self.biker_offsets = np.concatenate([[0], self.biker_end]).astype(np.int64)
+
+    @classmethod
+    def open(cls, path):
+        return cls(path)
+
+    def __len__(self):
+        return len(self.step)
+
+    def edge_deltas(self, i):
+        """(edge slots, road heat added to them) at the i-th step written"""
+        rows = slice(self.edge_offsets[i], self.edge_offsets[i + 1])
+        return self.edge_slot[rows], self.edge_heat[rows]
+
+    def biker_positions(self, i):
+        """(biker slots, x, y, total heat) of the bikers that moved at the i-th step written"""
+        rows = slice(self.biker_offsets[i], self.biker_offsets[i + 1])
+        return self.biker[rows], self.biker_x[rows], self.biker_y[rows], self.biker_heat[rows]
+
+    def road_heat(self, i=None):
+        """Road heat of every edge after the i-th step written, after the last one by default"""
+        end = self.edge_offsets[-1 if i is None else i + 1]
+        return np.bincount(self.edge_slot[:end], weights=self.edge_heat[:end], minlength=self.edges)
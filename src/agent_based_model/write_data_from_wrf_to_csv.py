@@ -15,6 +15,7 @@ def visualize_wrf_output(file_path, variable_name):
     times = extract_times(ncfile, timeidx=None)
 
     # Loop through each time step and plot the variable
+    t2_hours = []
     for time_idx, time in enumerate(times):
         # Extract the desired variable for the current time step
         var = getvar(ncfile, variable_name, timeidx=time_idx)
@@ -30,6 +31,11 @@ def visualize_wrf_output(file_path, variable_name):
         np.savetxt('lat_array_2.csv', lats_np, delimiter=',')
         np.savetxt('lon_array_2.csv', lons_np, delimiter=',')
         np.savetxt('t2_array_2.csv', t2_np, delimiter=',')
+        t2_hours.append(t2_np)
+
+    # write every output hour for the time varying heat model, shape (hours, lat, lon) - see heat_field.py
+    np.save('t2_hourly_2.npy', np.stack(t2_hours))
+    np.save('t2_times_2.npy', np.asarray(times, dtype='datetime64[s]'))
 
 
 # Paths to the wrfout files for domains d02 and d03
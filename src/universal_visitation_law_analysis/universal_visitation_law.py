@@ -4,6 +4,11 @@ import math
 from geopy.distance import geodesic
 import json
 import os
+import sys
+
+# trip loading is shared with the agent based model, see src/agent_based_model/citibike_trips.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'agent_based_model'))
+from citibike_trips import load_trips
 
 # Constants
 LATITUDE_DEGREE_METERS = 111320  # meters per degree of latitude
@@ -50,129 +55,116 @@ def normalize(num_rides, bucket):
     return 0 if num == 0 else math.log10(num)
 
 
-# read in dataframe - time period = 1 month (july)
-csv_directory = '/Users/emmacorbett/PycharmProjects/USE_Lab/data/Citibike/5_May_2024'
-#csv_directory = '/Users/emmacorbett/PycharmProjects/USE_Lab/data/Citibike/test'
-# Uncomment out the below to create the initial distances file (takes like 10min to run)
-# List to store individual DataFrames
-# dataframes = []
-#
-# # Loop through each file in the directory
-# for filename in os.listdir(csv_directory):
-#     if filename.endswith('.csv'):
-#         # Full path of the CSV file
-#         file_path = os.path.join(csv_directory, filename)
-#
-#         # Read the CSV file into a DataFrame
-#         df = pd.read_csv(file_path)
-#
-#         # Append the DataFrame to the list
-#         dataframes.append(df)
-#
-# # Concatenate all DataFrames in the list into a single DataFrame
-# df_rides = pd.concat(dataframes, ignore_index=True)
-#
-# # filters for all start and end coordinates to be within new york city boundary
-# df_rides = df_rides[df_rides.apply(lambda row: is_valid_location(row['start_lat'], row['start_lng']), axis=1)]
-# df_rides = df_rides[df_rides.apply(lambda row: is_valid_location(row['end_lat'], row['end_lng']), axis=1)]
-#
-# # create map of grid cells to their boundaries
-# grid_cells = {}
-#
-# # Assign grid cells and their boundaries to each ride's origin location
-# df_rides[['origin_grid_cell']] = df_rides.apply(
-#     lambda row: pd.Series(get_grid_cell_with_center(
-#         row['start_lat'], row['start_lng'], lat_min, lon_min, lat_step, lon_step, grid_cells
-#     )), axis=1
-# )
-#
-# # Assign grid cells and their boundaries to each ride's destination location
-# df_rides[['destination_grid_cell']] = df_rides.apply(
-#     lambda row: pd.Series(get_grid_cell_with_center(
-#         row['end_lat'], row['end_lng'], lat_min, lon_min, lat_step, lon_step, grid_cells
-#     )), axis=1
-# )
-#
-# with open('grid_cells_2024.json', 'w') as file:
-#     json.dump(grid_cells, file)
-
-with open('grid_cells_2024.json', 'r') as file:
-    grid_cells = json.load(file)
-# df_rides.to_csv('df_rides_2024.csv', index=False)
-df_rides = pd.read_csv('df_rides_2024.csv')
-
-# Aggregate the total number of rides that ended in each grid cell
-aggregated_destination_rides = df_rides.groupby('destination_grid_cell').size().reset_index(name='total_destination_rides')
-
-# get the top n most visited destinations
-n = 3
-top_n_destinations = aggregated_destination_rides.sort_values(by='total_destination_rides', ascending=False).head(n)
-# get number of rides within x distance away for origin
-
-# max_bucket = []
-# max_bucket_electric = []
-for i in range(n):
-    dest = top_n_destinations.iloc[i]
-    dest_grid_cell = dest['destination_grid_cell']
-    dest_center = grid_cells[dest_grid_cell]
-    df_rides_filtered = df_rides[df_rides['destination_grid_cell'] == dest_grid_cell]
-    df_rides_filtered['distance_to_top_destination'] = df_rides_filtered.apply(
-        lambda row: calculate_distance(row['start_lat'], row['start_lng'], dest_center[0], dest_center[1]),
-        axis=1
-    )
-    df_rides_filtered.to_csv('distance_to_top_' + str(i) + '_2024.csv')
-    df_rides_electric = df_rides_filtered.copy(deep=True)
-    df_rides_classic = df_rides_filtered.copy(deep=True)
-    df_rides_electric = df_rides_electric.drop(df_rides_electric[df_rides_electric['rideable_type'] != "electric_bike"].index)
-    df_rides_classic = df_rides_classic.drop(df_rides_classic[df_rides_classic['rideable_type'] != "classic_bike"].index)
-
-    bins = range(0, 19000, 500)
-    #df_rides_filtered['distance_bin'] = pd.cut(df_rides_filtered['distance_to_top_destination'], bins=bins)
-    df_rides_electric['distance_bin'] = pd.cut(df_rides_electric['distance_to_top_destination'], bins=bins)
-    df_rides_classic['distance_bin'] = pd.cut(df_rides_classic['distance_to_top_destination'], bins=bins)
-
-    # Aggregate the number of rides for each distance bin
-    #distance_ride_counts = df_rides_filtered.groupby('distance_bin').size().reset_index(name='num_rides')
-    distance_ride_counts_classic = df_rides_classic.groupby('distance_bin').size().reset_index(name='num_rides')
-    distance_ride_counts_electric = df_rides_electric.groupby('distance_bin').size().reset_index(name='num_rides')
-
-    #normalize the number of rides based on bin
-    # distance_ride_counts[['num_rides']] = distance_ride_counts.apply(
-    #     lambda row: pd.Series(normalize(
-    #         row['num_rides'], row['distance_bin'])), axis=1
-    # )
-    distance_ride_counts_classic[['num_rides']] = distance_ride_counts_classic.apply(
-        lambda row: pd.Series(normalize(
-            row['num_rides'], row['distance_bin'])), axis=1
-    )
-    distance_ride_counts_electric[['num_rides']] = distance_ride_counts_electric.apply(
-        lambda row: pd.Series(normalize(
-            row['num_rides'], row['distance_bin'])), axis=1
-    )
-
-    # get buckets where ridership peaks
-    # idmax = distance_ride_counts['num_rides'].idxmax()
-    # max_bucket.append(distance_ride_counts['distance_bin'].loc[idmax])
-
-    plot_bins = [math.log10(x + 250) if x != 0 else math.log10(250) for x in bins]
-    plot_bins = plot_bins[:-1]
-    # distance_ride_counts.to_csv('top_' + str(i) + '_distance.csv', index=False)
-    # distance_ride_counts_classic.to_csv('top_' + str(i) + '_distance_classic_2024.csv', index=False)
-    # distance_ride_counts_electric.to_csv('top_' + str(i) + '_distance_electric_2024.csv', index=False)
-    plt.figure(figsize=(10, 6))
-    #plt.plot(plot_bins, distance_ride_counts['num_rides'], marker='o', label='classic')
-    plt.plot(plot_bins, distance_ride_counts_classic['num_rides'], marker='o', label='classic')
-    plt.plot(plot_bins, distance_ride_counts_electric['num_rides'], marker='o', label='electric')
-    plt.xticks(rotation=90)
-    plt.xlabel('Distance from Destination (meters)')
-    plt.ylabel('Number of Rides')
-    plt.title('Classic v Electric: Number of Rides vs Distance from Destination- ')
-    plt.grid(True)
-    plt.tight_layout()
-    plt.legend()
-    # plt.show()
-    # plt.savefig('plot' + str(i) + '_classic_v_electric_2024.png')
-
-# print(max_bucket)
-# print(max_bucket_electric)
-# TODO: Account for bounds of ocean in calculating normalizing area
\ No newline at end of file
+# the csv files are read in worker processes, which import this file again, so the analysis only runs as main
+if __name__ == '__main__':
+    # read in dataframe - time period = 1 month (july)
+    csv_directory = '/Users/emmacorbett/PycharmProjects/USE_Lab/data/Citibike/5_May_2024'
+    #csv_directory = '/Users/emmacorbett/PycharmProjects/USE_Lab/data/Citibike/test'
+    # create the rides and grid cell files on the first run
+    if not os.path.exists('df_rides_2024.csv'):
+        # every ride with its start and end coordinates within new york city boundary, the csv files are only read
+        # on the first call and cached as parquet after, see citibike_trips.py
+        df_rides = load_trips(csv_directory,
+                              columns=['rideable_type', 'start_lat', 'start_lng', 'end_lat', 'end_lng'],
+                              bounds=(lon_min, lat_min, lon_max, lat_max))
+
+        # create map of grid cells to their boundaries
+        grid_cells = {}
+
+        # Assign grid cells and their boundaries to each ride's origin location
+        df_rides[['origin_grid_cell']] = df_rides.apply(
+            lambda row: pd.Series(get_grid_cell_with_center(
+                row['start_lat'], row['start_lng'], lat_min, lon_min, lat_step, lon_step, grid_cells
+            )), axis=1
+        )
+
+        # Assign grid cells and their boundaries to each ride's destination location
+        df_rides[['destination_grid_cell']] = df_rides.apply(
+            lambda row: pd.Series(get_grid_cell_with_center(
+                row['end_lat'], row['end_lng'], lat_min, lon_min, lat_step, lon_step, grid_cells
+            )), axis=1
+        )
+
+        with open('grid_cells_2024.json', 'w') as file:
+            json.dump(grid_cells, file)
+        df_rides.to_csv('df_rides_2024.csv', index=False)
+
+    with open('grid_cells_2024.json', 'r') as file:
+        grid_cells = json.load(file)
+    df_rides = pd.read_csv('df_rides_2024.csv')
+
+    # Aggregate the total number of rides that ended in each grid cell
+    aggregated_destination_rides = df_rides.groupby('destination_grid_cell').size().reset_index(name='total_destination_rides')
+
+    # get the top n most visited destinations
+    n = 3
+    top_n_destinations = aggregated_destination_rides.sort_values(by='total_destination_rides', ascending=False).head(n)
+    # get number of rides within x distance away for origin
+
+    # max_bucket = []
+    # max_bucket_electric = []
+    for i in range(n):
+        dest = top_n_destinations.iloc[i]
+        dest_grid_cell = dest['destination_grid_cell']
+        dest_center = grid_cells[dest_grid_cell]
+        df_rides_filtered = df_rides[df_rides['destination_grid_cell'] == dest_grid_cell]
+        df_rides_filtered['distance_to_top_destination'] = df_rides_filtered.apply(
+            lambda row: calculate_distance(row['start_lat'], row['start_lng'], dest_center[0], dest_center[1]),
+            axis=1
+        )
+        df_rides_filtered.to_csv('distance_to_top_' + str(i) + '_2024.csv')
+        df_rides_electric = df_rides_filtered.copy(deep=True)
+        df_rides_classic = df_rides_filtered.copy(deep=True)
+        df_rides_electric = df_rides_electric.drop(df_rides_electric[df_rides_electric['rideable_type'] != "electric_bike"].index)
+        df_rides_classic = df_rides_classic.drop(df_rides_classic[df_rides_classic['rideable_type'] != "classic_bike"].index)
+
+        bins = range(0, 19000, 500)
+        #df_rides_filtered['distance_bin'] = pd.cut(df_rides_filtered['distance_to_top_destination'], bins=bins)
+        df_rides_electric['distance_bin'] = pd.cut(df_rides_electric['distance_to_top_destination'], bins=bins)
+        df_rides_classic['distance_bin'] = pd.cut(df_rides_classic['distance_to_top_destination'], bins=bins)
+
+        # Aggregate the number of rides for each distance bin
+        #distance_ride_counts = df_rides_filtered.groupby('distance_bin').size().reset_index(name='num_rides')
+        distance_ride_counts_classic = df_rides_classic.groupby('distance_bin').size().reset_index(name='num_rides')
+        distance_ride_counts_electric = df_rides_electric.groupby('distance_bin').size().reset_index(name='num_rides')
+
+        #normalize the number of rides based on bin
+        # distance_ride_counts[['num_rides']] = distance_ride_counts.apply(
+        #     lambda row: pd.Series(normalize(
+        #         row['num_rides'], row['distance_bin'])), axis=1
+        # )
+        distance_ride_counts_classic[['num_rides']] = distance_ride_counts_classic.apply(
+            lambda row: pd.Series(normalize(
+                row['num_rides'], row['distance_bin'])), axis=1
+        )
+        distance_ride_counts_electric[['num_rides']] = distance_ride_counts_electric.apply(
+            lambda row: pd.Series(normalize(
+                row['num_rides'], row['distance_bin'])), axis=1
+        )
+
+        # get buckets where ridership peaks
+        # idmax = distance_ride_counts['num_rides'].idxmax()
+        # max_bucket.append(distance_ride_counts['distance_bin'].loc[idmax])
+
+        plot_bins = [math.log10(x + 250) if x != 0 else math.log10(250) for x in bins]
+        plot_bins = plot_bins[:-1]
+        # distance_ride_counts.to_csv('top_' + str(i) + '_distance.csv', index=False)
+        # distance_ride_counts_classic.to_csv('top_' + str(i) + '_distance_classic_2024.csv', index=False)
+        # distance_ride_counts_electric.to_csv('top_' + str(i) + '_distance_electric_2024.csv', index=False)
+        plt.figure(figsize=(10, 6))
+        #plt.plot(plot_bins, distance_ride_counts['num_rides'], marker='o', label='classic')
+        plt.plot(plot_bins, distance_ride_counts_classic['num_rides'], marker='o', label='classic')
+        plt.plot(plot_bins, distance_ride_counts_electric['num_rides'], marker='o', label='electric')
+        plt.xticks(rotation=90)
+        plt.xlabel('Distance from Destination (meters)')
+        plt.ylabel('Number of Rides')
+        plt.title('Classic v Electric: Number of Rides vs Distance from Destination- ')
+        plt.grid(True)
+        plt.tight_layout()
+        plt.legend()
+        # plt.show()
+        # plt.savefig('plot' + str(i) + '_classic_v_electric_2024.png')
+
+    # print(max_bucket)
+    # print(max_bucket_electric)
+    # TODO: Account for bounds of ocean in calculating normalizing area
\ No newline at end of file